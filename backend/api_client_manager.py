@@ -1,28 +1,23 @@
 import json
+import shlex
 import uuid
 
 import paramiko
 
 
-def add_user_via_api(server_ip, ssh_user, ssh_password, ssh_port, username):
+def add_users_via_api(server_ip, ssh_user, ssh_password, ssh_port, users):
     """
-    Add a user to the Xray server using the API instead of config file modification.
-    Returns the generated UUID.
+    Add several users to the Xray server in one SSH session and one `adu` call.
+    `users` is a list of (username, uuid) pairs; existing UUIDs are kept as-is.
     """
     ssh_client = paramiko.SSHClient()
     ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
 
     try:
-        # Generate new UUID
-        new_uuid = str(uuid.uuid4())
-
-        # Connect to server
         ssh_client.connect(
             hostname=server_ip, username=ssh_user, password=ssh_password, port=ssh_port
         )
 
-        # Create user JSON for the API (format based on GitHub PR #4943)
-        # The adu command expects full inbound configuration structure
         user_config = {
             "inbounds": [
                 {
@@ -34,73 +29,60 @@ def add_user_via_api(server_ip, ssh_user, ssh_password, ssh_port, username):
                         "decryption": "none",
                         "clients": [
                             {
-                                "id": new_uuid,
+                                "id": user_uuid,
                                 "email": username,
                                 "flow": "xtls-rprx-vision",
                             }
+                            for username, user_uuid in users
                         ],
                     },
                 }
             ]
         }
 
-        # Create temporary file with user config on the server
-        remote_temp_path = f"/tmp/user_{new_uuid}.json"
-        config_json = json.dumps(user_config, indent=2)
-
-        # Write config to remote file
+        remote_temp_path = f"/tmp/users_{uuid.uuid4()}.json"
         sftp = ssh_client.open_sftp()
         with sftp.file(remote_temp_path, "w") as remote_file:
-            remote_file.write(config_json)
+            remote_file.write(json.dumps(user_config, indent=2))
         sftp.close()
 
         try:
-            # Add user via Xray API
             cmd = f"/usr/local/bin/xray api adu --server=127.0.0.1:8081 {remote_temp_path}"
             stdin, stdout, stderr = ssh_client.exec_command(cmd)
             exit_status = stdout.channel.recv_exit_status()
 
             if exit_status != 0:
-                stdout_content = stdout.read().decode("utf-8")
                 stderr_content = stderr.read().decode("utf-8")
                 raise Exception(
                     f"Xray API command failed (exit code {exit_status}): {stderr_content}"
                 )
-
-            return new_uuid
-
         finally:
-            # Clean up remote temp file
             ssh_client.exec_command(f"rm {remote_temp_path}")
 
-    except Exception as e:
-        print(f"ERROR in add_user_via_api for user '{username}': {str(e)}")
-        raise
     finally:
         ssh_client.close()
 
 
-def remove_user_via_api(server_ip, ssh_user, ssh_password, ssh_port, username):
+def remove_users_via_api(server_ip, ssh_user, ssh_password, ssh_port, usernames):
     """
-    Remove a user from the Xray server using the API.
+    Remove several users from the Xray server with a single `rmu` call.
     """
     ssh_client = paramiko.SSHClient()
     ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
 
     try:
-        # Connect to server
         ssh_client.connect(
             hostname=server_ip, username=ssh_user, password=ssh_password, port=ssh_port
         )
 
-        # Remove user via Xray API
-        cmd = f"/usr/local/bin/xray api rmu --server=127.0.0.1:8081 -tag=reality-in {username}"
+        emails = " ".join(shlex.quote(username) for username in usernames)
+        cmd = f"/usr/local/bin/xray api rmu --server=127.0.0.1:8081 -tag=reality-in {emails}"
         stdin, stdout, stderr = ssh_client.exec_command(cmd)
         exit_status = stdout.channel.recv_exit_status()
 
         if exit_status != 0:
             error_msg = stderr.read().decode("utf-8")
-            raise Exception(f"Failed to remove user via API: {error_msg}")
+            raise Exception(f"Failed to remove users via API: {error_msg}")
 
     finally:
         ssh_client.close()
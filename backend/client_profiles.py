@@ -0,0 +1,307 @@
+import copy
+import hashlib
+import json
+import threading
+
+from registry import registry
+
+CLIENT_TEMPLATE_PATH = "xray_client/config.json"
+GEOSITE_PATH = "xray_client/geosite.dat"
+
+# geosite categories routed around the proxy unless the caller picks others.
+DEFAULT_DIRECT_SITES = ("private", "apple", "microsoft", "steam")
+# Spelled out so clients don't also need a geoip.dat next to the geosite.dat.
+PRIVATE_IP_RANGES = (
+    "0.0.0.0/8",
+    "10.0.0.0/8",
+    "100.64.0.0/10",
+    "127.0.0.0/8",
+    "169.254.0.0/16",
+    "172.16.0.0/12",
+    "192.168.0.0/16",
+    "224.0.0.0/4",
+    "::1/128",
+    "fc00::/7",
+    "fe80::/10",
+)
+PROBE_URL = "https://www.gstatic.com/generate_204"
+PROXY_TAG_PREFIX = "proxy-"
+
+# geosite.dat Domain.Type -> sing-box route rule key
+_SINGBOX_DOMAIN_KEYS = {
+    0: "domain_keyword",  # Plain
+    1: "domain_regex",  # Regex
+    2: "domain_suffix",  # RootDomain
+    3: "domain",  # Full
+}
+
+
+def _read_varint(data, i):
+    result = shift = 0
+    while True:
+        byte = data[i]
+        i += 1
+        result |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            return result, i
+
+
+def _iter_fields(data):
+    """Yield (field_number, value) pairs of a protobuf message.
+
+    Only varint and length-delimited wire types occur in geosite.dat.
+    """
+    i = 0
+    while i < len(data):
+        key, i = _read_varint(data, i)
+        wire_type = key & 7
+        if wire_type == 0:
+            value, i = _read_varint(data, i)
+        elif wire_type == 2:
+            length, i = _read_varint(data, i)
+            value = data[i : i + length]
+            i += length
+        else:
+            raise ValueError(f"Unsupported protobuf wire type {wire_type}")
+        yield key >> 3, value
+
+
+class GeoSite:
+    """Lazy reader for the bundled geosite.dat (a protobuf GeoSiteList).
+
+    Only the category offsets are indexed up front; a category's domains
+    are decoded the first time it is requested.
+    """
+
+    def __init__(self, path=GEOSITE_PATH):
+        self.path = path
+        self._data = None
+        self._offsets = None
+        self._domains = {}
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._offsets is not None:
+                return
+            with open(self.path, "rb") as f:
+                data = f.read()
+            offsets = {}
+            for field, entry in _iter_fields(memoryview(data)):
+                if field != 1:
+                    continue
+                for entry_field, value in _iter_fields(entry):
+                    if entry_field == 1:
+                        offsets[bytes(value).decode("utf-8").lower()] = entry
+                        break
+            self._data = data
+            self._offsets = offsets
+
+    def categories(self):
+        self._load()
+        return sorted(self._offsets)
+
+    def has_category(self, name):
+        self._load()
+        return name.lower() in self._offsets
+
+    def domains(self, name):
+        """Return [(type, value)] for a category, as stored in geosite.dat."""
+        self._load()
+        name = name.lower()
+        if name not in self._domains:
+            domains = []
+            for field, value in _iter_fields(self._offsets[name]):
+                if field != 2:
+                    continue
+                domain_type, domain_value = 0, ""
+                for domain_field, domain_part in _iter_fields(value):
+                    if domain_field == 1:
+                        domain_type = domain_part
+                    elif domain_field == 2:
+                        domain_value = bytes(domain_part).decode("utf-8")
+                domains.append((domain_type, domain_value))
+            self._domains[name] = domains
+        return self._domains[name]
+
+
+geosite = GeoSite()
+
+
+def _user_endpoints(username):
+    """Return [(server, client)] for every server `username` has an account on."""
+    endpoints = []
+    for server in registry.get_servers():
+        client = registry.get_client_by_name(server.id, username)
+        if client:
+            endpoints.append((server, client))
+    return endpoints
+
+
+def _xray_outbound(template, server, client):
+    outbound = copy.deepcopy(template)
+    outbound["tag"] = f"{PROXY_TAG_PREFIX}{server.id}"
+    vnext = outbound["settings"]["vnext"][0]
+    vnext["address"] = server.server_ip
+    vnext["port"] = 443
+    vnext["users"][0]["id"] = client.uuid
+    reality = outbound["streamSettings"]["realitySettings"]
+    reality["serverName"] = server.mask_domain
+    reality["publicKey"] = server.public_key
+    reality["shortId"] = server.short_id
+    return outbound
+
+
+def build_xray_profile(endpoints, direct_sites):
+    """Render an Xray client config from the bundled xray_client/config.json.
+
+    Every server gets its own VLESS outbound; a leastPing balancer fed by
+    the observatory picks between them. Private ranges and the given
+    geosite categories bypass the proxy.
+    """
+    with open(CLIENT_TEMPLATE_PATH) as f:
+        profile = json.load(f)
+    vless_template = next(
+        o for o in profile["outbounds"] if o.get("protocol") == "vless"
+    )
+
+    proxy_outbounds = [
+        _xray_outbound(vless_template, server, client) for server, client in endpoints
+    ]
+    profile["outbounds"] = proxy_outbounds + [
+        {"protocol": "freedom", "tag": "direct"},
+        {"protocol": "blackhole", "tag": "block"},
+    ]
+    profile["observatory"] = {
+        "subjectSelector": [PROXY_TAG_PREFIX],
+        "probeURL": PROBE_URL,
+        "probeInterval": "1m",
+    }
+    profile["routing"] = {
+        "domainStrategy": "IPIfNonMatch",
+        "balancers": [
+            {
+                "tag": "fleet",
+                "selector": [PROXY_TAG_PREFIX],
+                "strategy": {"type": "leastPing"},
+            }
+        ],
+        "rules": [
+            {
+                "type": "field",
+                "ip": list(PRIVATE_IP_RANGES),
+                "outboundTag": "direct",
+            },
+            {
+                "type": "field",
+                "domain": [f"geosite:{site}" for site in direct_sites],
+                "outboundTag": "direct",
+            },
+            {"type": "field", "network": "tcp,udp", "balancerTag": "fleet"},
+        ],
+    }
+    return profile
+
+
+def build_singbox_profile(endpoints, direct_sites):
+    """Render the same routing as a sing-box config.
+
+    sing-box cannot read geosite.dat, so the chosen categories are expanded
+    into inline domain rules from the bundled file.
+    """
+    proxy_outbounds = [
+        {
+            "type": "vless",
+            "tag": f"{PROXY_TAG_PREFIX}{server.id}",
+            "server": server.server_ip,
+            "server_port": 443,
+            "uuid": client.uuid,
+            "flow": "xtls-rprx-vision",
+            "packet_encoding": "xudp",
+            "tls": {
+                "enabled": True,
+                "server_name": server.mask_domain,
+                "utls": {"enabled": True, "fingerprint": "chrome"},
+                "reality": {
+                    "enabled": True,
+                    "public_key": server.public_key,
+                    "short_id": server.short_id,
+                },
+            },
+        }
+        for server, client in endpoints
+    ]
+
+    direct_rule = {}
+    for site in direct_sites:
+        for domain_type, value in geosite.domains(site):
+            direct_rule.setdefault(_SINGBOX_DOMAIN_KEYS[domain_type], []).append(value)
+    rules = [{"ip_is_private": True, "outbound": "direct"}]
+    if direct_rule:
+        rules.append({**direct_rule, "outbound": "direct"})
+
+    return {
+        "log": {"level": "warn"},
+        "inbounds": [
+            {
+                "type": "mixed",
+                "tag": "mixed-in",
+                "listen": "127.0.0.1",
+                "listen_port": 10808,
+            }
+        ],
+        "outbounds": [
+            {
+                "type": "urltest",
+                "tag": "fleet",
+                "outbounds": [o["tag"] for o in proxy_outbounds],
+                "url": PROBE_URL,
+                "interval": "1m",
+            },
+            *proxy_outbounds,
+            {"type": "direct", "tag": "direct"},
+        ],
+        "route": {"rules": rules, "final": "fleet", "auto_detect_interface": True},
+    }
+
+
+PROFILE_BUILDERS = {"xray": build_xray_profile, "singbox": build_singbox_profile}
+PROFILE_CACHE_SIZE = 1024
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def get_client_profile(username, profile_format="xray", direct_sites=None):
+    """Return (profile_json, version) for a user, or None if they have no servers.
+
+    Rendered profiles are cached per (user, format, categories) and reused
+    until the registry changes. The version is a hash of the rendered
+    profile, so it only moves when the profile content does.
+    """
+    direct_sites = tuple(direct_sites or DEFAULT_DIRECT_SITES)
+    unknown = [site for site in direct_sites if not geosite.has_category(site)]
+    if unknown:
+        raise ValueError(f"Unknown geosite categories: {', '.join(unknown)}")
+    if profile_format not in PROFILE_BUILDERS:
+        raise ValueError(f"Unknown profile format: {profile_format}")
+
+    key = (username, profile_format, direct_sites)
+    registry_version = registry.latest_version()
+    with _cache_lock:
+        cached = _cache.get(key)
+    if cached and cached[0] == registry_version:
+        return cached[1], cached[2]
+
+    endpoints = _user_endpoints(username)
+    if not endpoints:
+        return None
+    profile = PROFILE_BUILDERS[profile_format](endpoints, direct_sites)
+    body = json.dumps(profile, indent=2)
+    version = hashlib.sha256(body.encode("utf-8")).hexdigest()[:16]
+    with _cache_lock:
+        if len(_cache) >= PROFILE_CACHE_SIZE:
+            _cache.clear()
+        _cache[key] = (registry_version, body, version)
+    return body, version
@@ -0,0 +1,235 @@
+import base64
+import hashlib
+import json
+import re
+import secrets
+import uuid
+from dataclasses import dataclass
+from typing import Tuple
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+
+DEFAULT_USER = "DefaultUser"
+FLOW = "xtls-rprx-vision"
+PROXY_PORT = 443
+API_PORT = 8081
+# Xray accepts short IDs of up to 8 bytes, written as hex.
+MAX_SHORT_ID_BYTES = 8
+
+_HOSTNAME = re.compile(
+    r"^(?=.{1,253}$)([a-z0-9]([a-z0-9-]{0,61}[a-z0-9])?\.)+[a-z]{2,63}$", re.IGNORECASE
+)
+_HEX = re.compile(r"^[0-9a-f]*$")
+
+
+class ConfigError(ValueError):
+    """A server config failed local validation."""
+
+
+def _encode_key(raw: bytes) -> str:
+    # Same encoding `xray x25519` prints: base64url without padding.
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_key(key: str) -> bytes:
+    try:
+        raw = base64.urlsafe_b64decode(key + "=" * (-len(key) % 4))
+    except ValueError:
+        raise ConfigError("Reality key is not valid base64url")
+    if len(raw) != 32:
+        raise ConfigError("Reality key must be 32 bytes")
+    return raw
+
+
+def public_key_for(private_key: str) -> str:
+    raw = X25519PrivateKey.from_private_bytes(_decode_key(private_key))
+    return _encode_key(
+        raw.public_key().public_bytes(
+            serialization.Encoding.Raw, serialization.PublicFormat.Raw
+        )
+    )
+
+
+def generate_reality_keys() -> Tuple[str, str]:
+    """Return a new (private_key, public_key) pair, as `xray x25519` would."""
+    raw = bytearray(secrets.token_bytes(32))
+    # Clamp like xray does, so the stored private key matches what it prints.
+    raw[0] &= 248
+    raw[31] = (raw[31] & 127) | 64
+    private_key = _encode_key(bytes(raw))
+    return private_key, public_key_for(private_key)
+
+
+def generate_short_id(length: int = MAX_SHORT_ID_BYTES) -> str:
+    return secrets.token_hex(length)
+
+
+@dataclass(frozen=True)
+class RealityClient:
+    id: str
+    email: str
+    flow: str = FLOW
+
+
+@dataclass(frozen=True)
+class ServerConfig:
+    """Everything that goes into a server's Xray config.
+
+    Instances are immutable. Clients must present one of `short_ids` (an
+    empty one would let them connect without any).
+    """
+
+    mask_domain: str
+    private_key: str
+    clients: Tuple[RealityClient, ...]
+    short_ids: Tuple[str, ...]
+    port: int = PROXY_PORT
+    api_port: int = API_PORT
+
+    def validate(self):
+        """Raise ConfigError listing every problem found."""
+        problems = []
+        if not _HOSTNAME.match(self.mask_domain):
+            problems.append(f"invalid mask domain {self.mask_domain!r}")
+        try:
+            _decode_key(self.private_key)
+        except ConfigError as e:
+            problems.append(str(e))
+        for port in (self.port, self.api_port):
+            if not 0 < port < 65536:
+                problems.append(f"invalid port {port}")
+        if self.port == self.api_port:
+            problems.append("proxy and API ports must differ")
+        for short_id in self.short_ids:
+            if (
+                len(short_id) % 2
+                or len(short_id) > 2 * MAX_SHORT_ID_BYTES
+                or not _HEX.match(short_id)
+            ):
+                problems.append(f"invalid short ID {short_id!r}")
+        if not self.clients:
+            problems.append("at least one client is required")
+        seen_ids, seen_emails = set(), set()
+        for client in self.clients:
+            try:
+                uuid.UUID(client.id)
+            except ValueError:
+                problems.append(f"invalid client UUID {client.id!r}")
+            if not client.email:
+                problems.append("client email must not be empty")
+            if client.id in seen_ids:
+                problems.append(f"duplicate client UUID {client.id}")
+            if client.email in seen_emails:
+                problems.append(f"duplicate client email {client.email}")
+            seen_ids.add(client.id)
+            seen_emails.add(client.email)
+        if problems:
+            raise ConfigError("Invalid server config: " + "; ".join(problems))
+
+    def render(self) -> dict:
+        return {
+            "log": {
+                "loglevel": "info",
+                "access": "/var/log/xray/access.log",
+                "error": "/var/log/xray/error.log",
+            },
+            "api": {
+                "tag": "api",
+                "services": ["HandlerService", "LoggerService", "StatsService"],
+            },
+            "stats": {},
+            "policy": {
+                "levels": {"0": {"statsUserUplink": True, "statsUserDownlink": True}},
+                "system": {"statsInboundUplink": True, "statsInboundDownlink": True},
+            },
+            "routing": {
+                "rules": [
+                    {"type": "field", "inboundTag": ["api"], "outboundTag": "api"},
+                    {
+                        "type": "field",
+                        "protocol": ["bittorrent"],
+                        "outboundTag": "block",
+                    },
+                ],
+                "domainStrategy": "IPIfNonMatch",
+            },
+            "inbounds": [
+                {
+                    "tag": "api",
+                    "listen": "127.0.0.1",
+                    "port": self.api_port,
+                    "protocol": "dokodemo-door",
+                    "settings": {"address": "127.0.0.1"},
+                },
+                {
+                    "listen": "0.0.0.0",
+                    "port": self.port,
+                    "protocol": "vless",
+                    "tag": "reality-in",
+                    "settings": {
+                        "clients": [
+                            {"id": c.id, "email": c.email, "flow": c.flow}
+                            for c in self.clients
+                        ],
+                        "decryption": "none",
+                    },
+                    "streamSettings": {
+                        "network": "tcp",
+                        "security": "reality",
+                        "realitySettings": {
+                            "show": False,
+                            "dest": f"{self.mask_domain}:443",
+                            "xver": 0,
+                            "serverNames": [self.mask_domain],
+                            "privateKey": self.private_key,
+                            "minClientVer": "",
+                            "maxClientVer": "",
+                            "maxTimeDiff": 0,
+                            "shortIds": list(self.short_ids),
+                        },
+                    },
+                    "sniffing": {
+                        "enabled": True,
+                        "destOverride": ["http", "tls", "quic"],
+                    },
+                },
+            ],
+            "outbounds": [
+                {"protocol": "freedom", "tag": "direct"},
+                {"protocol": "blackhole", "tag": "block"},
+                {"protocol": "freedom", "tag": "api", "settings": {}},
+            ],
+        }
+
+
+def _check_references(config: dict):
+    """Catch routing mistakes Xray would only report when it restarts."""
+    inbound_tags = [i["tag"] for i in config["inbounds"] if "tag" in i]
+    outbound_tags = [o["tag"] for o in config["outbounds"] if "tag" in o]
+    problems = [
+        f"duplicate tag {tag}"
+        for tag in sorted(set(inbound_tags + outbound_tags))
+        if inbound_tags.count(tag) > 1 or outbound_tags.count(tag) > 1
+    ]
+    for rule in config["routing"]["rules"]:
+        if rule.get("outboundTag") not in outbound_tags:
+            problems.append(f"rule targets unknown outbound {rule.get('outboundTag')}")
+        for tag in rule.get("inboundTag", []):
+            if tag not in inbound_tags:
+                problems.append(f"rule matches unknown inbound {tag}")
+    if problems:
+        raise ConfigError("Invalid server config: " + "; ".join(problems))
+
+
+def compile_config(config: ServerConfig) -> Tuple[str, str]:
+    """Validate and render a config, returning (json_text, sha256).
+
+    The text is exactly what is written to the host, so the hash can be
+    compared with the file already there.
+    """
+    config.validate()
+    rendered = config.render()
+    _check_references(rendered)
+    text = json.dumps(rendered, indent=2) + "\n"
+    return text, hashlib.sha256(text.encode("utf-8")).hexdigest()
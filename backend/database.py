@@ -1,9 +1,12 @@
 import sqlite3
 
 
-def init_db():
-    conn = sqlite3.connect("vless_daddy.db")
+def init_db(db_path="vless_daddy.db"):
+    conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
+    # Persistent for the file: report scans read a snapshot while sample and
+    # job writes carry on, instead of failing with "database is locked".
+    cursor.execute("PRAGMA journal_mode=WAL")
     cursor.execute(
         """
         CREATE TABLE IF NOT EXISTS servers (
@@ -14,10 +17,17 @@ def init_db():
             ssh_port INTEGER NOT NULL DEFAULT 22,
             mask_domain TEXT NOT NULL,
             public_key TEXT NOT NULL,
-            proxy_name TEXT NOT NULL
+            proxy_name TEXT NOT NULL,
+            short_id TEXT NOT NULL DEFAULT ''
         )
     """
     )
+    # Databases created before Reality short IDs were generated lack the column.
+    cursor.execute("PRAGMA table_info(servers)")
+    if "short_id" not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute(
+            "ALTER TABLE servers ADD COLUMN short_id TEXT NOT NULL DEFAULT ''"
+        )
     cursor.execute(
         """
         CREATE TABLE IF NOT EXISTS clients (
@@ -29,5 +39,98 @@ def init_db():
         )
     """
     )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_clients_server_username ON clients (server_id, username)"
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS traffic_samples (
+            server_id INTEGER NOT NULL,
+            username TEXT NOT NULL,
+            ts REAL NOT NULL,
+            up INTEGER NOT NULL,
+            down INTEGER NOT NULL
+        )
+    """
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_traffic_samples_server_ts ON traffic_samples (server_id, ts)"
+    )
+    # Reports read samples per user series in time order.
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_traffic_samples_series ON traffic_samples (server_id, username, ts)"
+    )
+    # Every (server, user) series that was sampled, with its last counters as
+    # the baseline for the next delta.
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS traffic_series (
+            id INTEGER PRIMARY KEY,
+            server_id INTEGER NOT NULL,
+            username TEXT NOT NULL,
+            ts REAL NOT NULL,
+            up INTEGER NOT NULL,
+            down INTEGER NOT NULL,
+            UNIQUE (server_id, username)
+        )
+    """
+    )
+    # A server's usage per series for one hour or day, kept up to date as
+    # samples are recorded so reports never scan the samples themselves.
+    # The columns are packed arrays, see traffic_rollups.
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS traffic_rollups (
+            resolution INTEGER NOT NULL,
+            start INTEGER NOT NULL,
+            server_id INTEGER NOT NULL,
+            series BLOB NOT NULL,
+            up BLOB NOT NULL,
+            down BLOB NOT NULL,
+            rates BLOB NOT NULL,
+            PRIMARY KEY (resolution, start, server_id)
+        )
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS draining_servers (
+            server_id INTEGER PRIMARY KEY,
+            FOREIGN KEY (server_id) REFERENCES servers (id)
+        )
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS provision_jobs (
+            id INTEGER PRIMARY KEY,
+            server_ip TEXT NOT NULL,
+            ssh_user TEXT NOT NULL,
+            ssh_password TEXT NOT NULL,
+            ssh_port INTEGER NOT NULL DEFAULT 22,
+            mask_domain TEXT NOT NULL,
+            proxy_name TEXT NOT NULL,
+            overwrite INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'queued',
+            checkpoint TEXT NOT NULL DEFAULT '{}',
+            result TEXT,
+            error TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS provision_job_events (
+            job_id INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            message TEXT NOT NULL,
+            PRIMARY KEY (job_id, seq),
+            FOREIGN KEY (job_id) REFERENCES provision_jobs (id)
+        )
+    """
+    )
     conn.commit()
     conn.close()
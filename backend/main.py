@@ -1,26 +1,85 @@
+import asyncio
 import base64
+import hmac
 import io
-import sqlite3
+import os
 import uuid
+from datetime import datetime, timezone
 from typing import Optional
 
 import paramiko
 import pyqrcode
 import uvicorn
-from api_client_manager import add_user_via_api, remove_user_via_api
+from api_client_manager import get_user_info_via_api, list_users_via_api
+from client_profiles import get_client_profile
 from database import init_db
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-from proxy_creator import create_proxy_stream
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
+from mutation_queue import ClientExists, ClientNotFound, mutations
+from pagination import (
+    MAX_PAGE_SIZE,
+    decode_cursor,
+    encode_cursor,
+    list_response,
+    parse_fields,
+)
+from placement import (
+    choose_server,
+    fleet_snapshot,
+    group_moves,
+    plan_rebalance,
+    server_scores,
+    set_draining,
+)
+from profiling import (
+    MAX_PROFILE_SECONDS,
+    TracingMiddleware,
+    profile_for,
+    span,
+    tracer,
+)
+from provision_jobs import (
+    enqueue_job,
+    get_job,
+    retry_job,
+    start_workers,
+    stream_job_events,
+)
 from pydantic import BaseModel, Field
-from traffic_parser import get_traffic_usage
+from registry import ClientRecord, ServerRecord, clients_collection, registry
+from request_coalescer import coalescer
+from starlette.concurrency import run_in_threadpool
+from static_assets import static_assets
+from traffic_parser import get_traffic_usage, record_traffic_sample
+from traffic_reports import (
+    DEFAULT_PERCENTILES,
+    EXPORT_FORMATS,
+    HAS_PYARROW,
+    RollupReader,
+    SampleReader,
+    rate_percentiles,
+    top_users,
+    usage_report,
+)
+from traffic_rollups import backfill_rollups
 
 app = FastAPI()
+app.add_middleware(TracingMiddleware)
 
-app.mount("/static", StaticFiles(directory="frontend/build/static"), name="static")
-templates = Jinja2Templates(directory="frontend/build")
+# Admin-only endpoints (profiling, traces) are disabled unless this is set.
+ADMIN_TOKEN = os.environ.get("VLESS_DADDY_ADMIN_TOKEN")
+
+# Seconds a remote read result stays fresh for other viewers of the same server.
+TRAFFIC_TTL = 5
+USERS_TTL = 5
+
+# Seconds between background traffic reads of every server, so placement
+# rates and reports don't depend on someone viewing a traffic page.
+TRAFFIC_SAMPLE_INTERVAL = 300
+
+# Default projections for the list endpoints.
+SERVER_LIST_FIELDS = ("id", "server_ip", "mask_domain", "proxy_name")
+CLIENT_LIST_FIELDS = ("id", "uuid", "username")
 
 
 class ProxyRequest(BaseModel):
@@ -37,285 +96,582 @@ class ClientRequest(BaseModel):
     client_username: str
 
 
+class RetryRequest(BaseModel):
+    overwrite: Optional[bool] = None
+
+
 @app.on_event("startup")
 async def startup():
     init_db()
+    backfill_rollups()
+    registry.load()
+    static_assets.load()
+    start_workers()
+    app.state.traffic_sampler = asyncio.ensure_future(_sample_traffic())
 
 
 @app.get("/api/servers")
-async def get_servers():
-    conn = sqlite3.connect("vless_daddy.db")
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, server_ip, mask_domain, proxy_name FROM servers")
-    servers = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return JSONResponse(content=servers)
+async def get_servers(
+    request: Request,
+    limit: Optional[int] = Query(default=None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    since: Optional[int] = None,
+):
+    fields = parse_fields(fields, ServerRecord.PUBLIC_FIELDS, SERVER_LIST_FIELDS)
+
+    def load_page():
+        after = decode_cursor(cursor) if cursor else None
+        if after is not None and not isinstance(after, int):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        servers = registry.page_servers(after, limit)
+        next_cursor = None
+        if limit is not None and len(servers) == limit:
+            next_cursor = encode_cursor(servers[-1].id)
+        return servers, next_cursor
+
+    return list_response(
+        request, "servers", registry.version("servers"), since, fields, load_page
+    )
 
 
 @app.get("/api/servers/{server_id}")
 async def get_server_details(server_id: int):
-    conn = sqlite3.connect("vless_daddy.db")
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT id, proxy_name FROM servers WHERE id = ?",
-        (server_id,),
-    )
-    server = cursor.fetchone()
-    conn.close()
+    server = registry.get_server(server_id)
     if not server:
         raise HTTPException(status_code=404, detail="Server not found")
-    return JSONResponse(content=dict(server))
+    return JSONResponse(content={"id": server.id, "proxy_name": server.proxy_name})
+
+
+def _cleanup_server(server):
+    try:
+        ssh_client = paramiko.SSHClient()
+        ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        ssh_client.connect(
+            hostname=server.server_ip,
+            username=server.ssh_user,
+            password=server.ssh_password,
+        )
+        cleanup_command = "systemctl stop xray; rm -f /usr/local/etc/xray/config.json; rm -rf /var/log/xray"
+        stdin, stdout, stderr = ssh_client.exec_command(cleanup_command)
+        exit_status = stdout.channel.recv_exit_status()
+        if exit_status != 0:
+            # Log error but proceed with DB deletion
+            print(
+                f"Server cleanup failed for {server.server_ip}: {stderr.read().decode('utf-8')}"
+            )
+        ssh_client.close()
+    except Exception as e:
+        print(f"SSH connection failed during cleanup for {server.server_ip}: {e}")
 
 
 @app.delete("/api/servers/{server_id}")
 async def delete_server(server_id: int, cleanup: bool = False):
-    conn = sqlite3.connect("vless_daddy.db")
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-
-    if cleanup:
-        cursor.execute(
-            "SELECT server_ip, ssh_user, ssh_password FROM servers WHERE id = ?",
-            (server_id,),
-        )
-        server = cursor.fetchone()
-        if server:
-            try:
-                ssh_client = paramiko.SSHClient()
-                ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-                ssh_client.connect(
-                    hostname=server["server_ip"],
-                    username=server["ssh_user"],
-                    password=server["ssh_password"],
-                )
-                cleanup_command = "systemctl stop xray; rm -f /usr/local/etc/xray/config.json; rm -rf /var/log/xray"
-                stdin, stdout, stderr = ssh_client.exec_command(cleanup_command)
-                exit_status = stdout.channel.recv_exit_status()
-                if exit_status != 0:
-                    # Log error but proceed with DB deletion
-                    print(
-                        f"Server cleanup failed for {server['server_ip']}: {stderr.read().decode('utf-8')}"
-                    )
-                ssh_client.close()
-            except Exception as e:
-                print(
-                    f"SSH connection failed during cleanup for {server['server_ip']}: {e}"
-                )
-
-    # Delete from database
-    cursor.execute("DELETE FROM clients WHERE server_id = ?", (server_id,))
-    cursor.execute("DELETE FROM servers WHERE id = ?", (server_id,))
-    conn.commit()
-    conn.close()
+    # Through the mutation queue, so queued client changes can't recreate
+    # clients of the deleted server.
+    await mutations.delete_server(server_id, _cleanup_server if cleanup else None)
     return {"message": "Server deleted successfully"}
 
 
 @app.post("/api/proxy")
 async def api_create_proxy(proxy_request: ProxyRequest):
+    # Provisioning runs as a durable job; this response only follows its
+    # progress, so a dropped connection no longer abandons the host midway.
+    job_id = enqueue_job(
+        proxy_request.server_ip,
+        proxy_request.ssh_user,
+        proxy_request.ssh_password,
+        proxy_request.ssh_port,
+        proxy_request.mask_domain,
+        proxy_request.proxy_name,
+        proxy_request.overwrite,
+    )
     return StreamingResponse(
-        create_proxy_stream(
-            proxy_request.server_ip,
-            proxy_request.ssh_user,
-            proxy_request.ssh_password,
-            proxy_request.ssh_port,
-            proxy_request.mask_domain,
-            proxy_request.proxy_name,
-            proxy_request.overwrite,
-        ),
+        stream_job_events(job_id),
         media_type="text/event-stream",
+        headers={"X-Job-Id": str(job_id)},
+    )
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_provision_job(job_id: int):
+    job = get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JSONResponse(content=job)
+
+
+@app.get("/api/jobs/{job_id}/events")
+async def get_provision_job_events(job_id: int, after: int = 0):
+    if not get_job(job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return StreamingResponse(
+        stream_job_events(job_id, after), media_type="text/event-stream"
+    )
+
+
+@app.post("/api/jobs/{job_id}/retry")
+async def retry_provision_job(job_id: int, retry_request: RetryRequest):
+    job = get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if not retry_job(job_id, retry_request.overwrite):
+        raise HTTPException(status_code=409, detail="Only failed jobs can be retried")
+    return StreamingResponse(
+        stream_job_events(job_id, job["events"]), media_type="text/event-stream"
+    )
+
+
+def _is_search_cursor(after):
+    return (
+        isinstance(after, list)
+        and len(after) == 2
+        and isinstance(after[0], str)
+        and isinstance(after[1], int)
     )
 
 
 @app.get("/api/servers/{server_id}/clients")
-async def get_clients(server_id: int):
-    conn = sqlite3.connect("vless_daddy.db")
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT id, uuid, username FROM clients WHERE server_id = ?", (server_id,)
+async def get_clients(
+    request: Request,
+    server_id: int,
+    limit: Optional[int] = Query(default=None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    q: Optional[str] = None,
+    fields: Optional[str] = None,
+    since: Optional[int] = None,
+):
+    """List a server's clients, optionally paginated and filtered.
+
+    `q` is a username prefix; matches are ordered by username. Without it
+    clients are ordered by id. `since` ignores `q` and returns all changes.
+    """
+    fields = parse_fields(fields, ClientRecord.PUBLIC_FIELDS, CLIENT_LIST_FIELDS)
+
+    def load_page():
+        after = decode_cursor(cursor) if cursor else None
+        if q:
+            if after is not None and not _is_search_cursor(after):
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            clients = registry.search_clients(server_id, q, after, limit)
+        else:
+            if after is not None and not isinstance(after, int):
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            clients = registry.page_clients(server_id, after, limit)
+        next_cursor = None
+        if limit is not None and len(clients) == limit:
+            last = clients[-1]
+            next_cursor = encode_cursor([last.username, last.id] if q else last.id)
+        return clients, next_cursor
+
+    collection = clients_collection(server_id)
+    return list_response(
+        request, collection, registry.version(collection), since, fields, load_page
     )
-    clients = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return JSONResponse(content=clients)
 
 
 @app.get("/api/clients/{client_id}")
 async def get_client_details(client_id: int):
-    conn = sqlite3.connect("vless_daddy.db")
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT c.uuid, s.server_ip, s.mask_domain, s.public_key, s.proxy_name
-        FROM clients c
-        JOIN servers s ON c.server_id = s.id
-        WHERE c.id = ?
-    """,
-        (client_id,),
-    )
-    data = cursor.fetchone()
-    conn.close()
+    client = registry.get_client(client_id)
+    server = registry.get_server(client.server_id) if client else None
 
-    if not data:
+    if not server:
         raise HTTPException(status_code=404, detail="Client not found")
 
-    vless_link = f"vless://{data['uuid']}@{data['server_ip']}:443/?encryption=none&type=tcp&sni={data['mask_domain']}&fp=chrome&security=reality&alpn=h2&flow=xtls-rprx-vision&pbk={data['public_key']}&packetEncoding=xudp#{data['proxy_name']}"
+    vless_link = f"vless://{client.uuid}@{server.server_ip}:443/?encryption=none&type=tcp&sni={server.mask_domain}&fp=chrome&security=reality&alpn=h2&flow=xtls-rprx-vision&pbk={server.public_key}&sid={server.short_id}&packetEncoding=xudp#{server.proxy_name}"
 
-    qr = pyqrcode.create(vless_link)
-    buffer = io.BytesIO()
-    qr.png(buffer, scale=5)
-    qr_code_b64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
+    with span("qr.encode", client_id):
+        qr = pyqrcode.create(vless_link)
+        buffer = io.BytesIO()
+        qr.png(buffer, scale=5)
+        qr_code_b64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
 
     return JSONResponse(
-        content={"uuid": data["uuid"], "vless_link": vless_link, "qr_code": qr_code_b64}
+        content={"uuid": client.uuid, "vless_link": vless_link, "qr_code": qr_code_b64}
     )
 
 
 @app.post("/api/servers/{server_id}/clients")
 async def add_client(server_id: int, client_request: ClientRequest):
-    conn = sqlite3.connect("vless_daddy.db")
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-
     # Get server details
-    cursor.execute("SELECT * FROM servers WHERE id = ?", (server_id,))
-    server = cursor.fetchone()
+    server = registry.get_server(server_id)
 
     if not server:
-        conn.close()
         raise HTTPException(status_code=404, detail="Server not found")
 
     try:
-        # Add user via Xray API and get the generated UUID
-        new_uuid = add_user_via_api(
-            server["server_ip"],
-            server["ssh_user"],
-            server["ssh_password"],
-            server["ssh_port"],
-            client_request.client_username,
-        )
-
-        # Store in local database
-        cursor.execute(
-            "INSERT INTO clients (server_id, uuid, username) VALUES (?, ?, ?)",
-            (server_id, new_uuid, client_request.client_username),
-        )
-        conn.commit()
-        conn.close()
-
-        return {"message": "Client added successfully", "uuid": new_uuid}
-
+        # Queued with other changes to this server and applied as one batch
+        client = await mutations.add_client(server_id, client_request.client_username)
+        return {"message": "Client added successfully", "uuid": client.uuid}
+
+    except ClientNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ClientExists as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         print(
             f"ERROR: Failed to add client '{client_request.client_username}': {str(e)}"
         )
-        conn.close()
         raise HTTPException(status_code=500, detail=f"Failed to add client: {str(e)}")
 
 
+@app.post("/api/clients")
+async def add_client_auto(client_request: ClientRequest):
+    """Add a client on whichever server the placement scheduler picks."""
+    snapshot = await run_in_threadpool(fleet_snapshot)
+    server_id = choose_server(snapshot, client_request.client_username)
+    if server_id is None:
+        raise HTTPException(status_code=503, detail="No server available")
+    response = await add_client(server_id, client_request)
+    return {**response, "server_id": server_id}
+
+
+@app.get("/api/placement")
+async def get_placement():
+    snapshot = await run_in_threadpool(fleet_snapshot)
+    scores = server_scores(snapshot)
+    servers = [
+        {
+            "server_id": server_id,
+            "clients": len(info["clients"]),
+            "rate": sum(info["clients"].values()),
+            "latency": info["latency"],
+            "draining": info["draining"],
+            "score": scores.get(server_id),
+        }
+        for server_id, info in snapshot.items()
+    ]
+    return JSONResponse(
+        content={"servers": servers, "next_server_id": choose_server(snapshot)}
+    )
+
+
+@app.put("/api/servers/{server_id}/drain")
+async def drain_server(server_id: int, draining: bool = True):
+    if not registry.get_server(server_id):
+        raise HTTPException(status_code=404, detail="Server not found")
+    set_draining(server_id, draining)
+    return {"message": "Server drain state updated", "draining": draining}
+
+
+@app.post("/api/rebalance")
+async def rebalance(dry_run: bool = True, max_moves: int = 100):
+    snapshot = await run_in_threadpool(fleet_snapshot)
+    usernames = {}
+    for info in snapshot.values():
+        for client_id in list(info["clients"]):
+            client = registry.get_client(client_id)
+            if client is None:
+                # Deleted since the snapshot was taken.
+                del info["clients"][client_id]
+            else:
+                usernames[client_id] = client.username
+    moves = plan_rebalance(snapshot, usernames, max_moves=max_moves)
+    plan = [
+        {"client_id": client_id, "source": source, "target": target}
+        for client_id, source, target in moves
+    ]
+    if dry_run:
+        return {"moves": plan}
+
+    results = [
+        await mutations.move_clients(source, target, client_ids)
+        for (source, target), client_ids in group_moves(moves).items()
+    ]
+    return {"moves": plan, "results": results}
+
+
 @app.delete("/api/servers/{server_id}/clients/{client_id}")
 async def delete_client(server_id: int, client_id: int):
-    conn = sqlite3.connect("vless_daddy.db")
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-
     # Get client details before deletion
-    cursor.execute(
-        "SELECT username FROM clients WHERE id = ? AND server_id = ?",
-        (client_id, server_id),
-    )
-    client = cursor.fetchone()
+    client = registry.get_client(client_id)
 
-    if not client:
-        conn.close()
+    if not client or client.server_id != server_id:
         raise HTTPException(status_code=404, detail="Client not found")
 
     # Get server details
-    cursor.execute("SELECT * FROM servers WHERE id = ?", (server_id,))
-    server = cursor.fetchone()
+    server = registry.get_server(server_id)
 
     if not server:
-        conn.close()
         raise HTTPException(status_code=404, detail="Server not found")
 
     try:
-        # Remove user via Xray API
-        remove_user_via_api(
-            server["server_ip"],
-            server["ssh_user"],
-            server["ssh_password"],
-            server["ssh_port"],
-            client["username"],
-        )
-
-        # Remove from local database
-        cursor.execute(
-            "DELETE FROM clients WHERE id = ? AND server_id = ?", (client_id, server_id)
-        )
-        conn.commit()
-        conn.close()
-
+        await mutations.delete_client(server_id, client_id)
         return {"message": "Client deleted successfully"}
 
+    except ClientNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
-        conn.close()
         raise HTTPException(
             status_code=500, detail=f"Failed to delete client: {str(e)}"
         )
 
 
-@app.get("/api/servers/{server_id}/traffic")
-async def get_server_traffic(server_id: int):
-    conn = sqlite3.connect("vless_daddy.db")
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT server_ip, ssh_user, ssh_password, ssh_port FROM servers WHERE id = ?",
-        (server_id,),
-    )
-    server = cursor.fetchone()
-    conn.close()
+def _get_server_credentials(server_id: int):
+    server = registry.get_server(server_id)
     if not server:
         raise HTTPException(status_code=404, detail="Server not found")
+    return server.credentials()
+
+
+def _fetch_traffic(server_id, *credentials):
+    traffic_data = get_traffic_usage(*credentials)
+    # Each real read doubles as a sample for rate-based client placement.
+    if traffic_data:
+        record_traffic_sample(server_id, traffic_data)
+    return traffic_data
+
 
-    traffic_data = get_traffic_usage(
-        server["server_ip"],
-        server["ssh_user"],
-        server["ssh_password"],
-        server["ssh_port"],
+async def _coalesced_traffic(server_id: int):
+    credentials = _get_server_credentials(server_id)
+    return await coalescer.run(
+        (server_id, "traffic"),
+        _fetch_traffic,
+        server_id,
+        *credentials,
+        ttl=TRAFFIC_TTL,
     )
+
+
+async def _sample_traffic():
+    while True:
+        for server in registry.get_servers():
+            # Through the coalescer, so a page view in progress is shared
+            # with the sampler instead of opening a second SSH session.
+            try:
+                await _coalesced_traffic(server.id)
+            except Exception as e:
+                print(f"ERROR: sampling traffic of server {server.id} failed: {str(e)}")
+        await asyncio.sleep(TRAFFIC_SAMPLE_INTERVAL)
+
+
+@app.get("/api/servers/{server_id}/traffic")
+async def get_server_traffic(server_id: int):
+    traffic_data = await _coalesced_traffic(server_id)
     return JSONResponse(content=traffic_data)
 
 
 @app.get("/api/servers/{server_id}/debug_traffic")
 async def get_debug_traffic(server_id: int):
-    conn = sqlite3.connect("vless_daddy.db")
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT server_ip, ssh_user, ssh_password, ssh_port FROM servers WHERE id = ?",
-        (server_id,),
+    traffic_data = await _coalesced_traffic(server_id)
+    return JSONResponse(content=traffic_data)
+
+
+@app.get("/api/servers/{server_id}/users")
+async def get_server_users(server_id: int):
+    credentials = _get_server_credentials(server_id)
+    try:
+        users = await coalescer.run(
+            (server_id, "users"), list_users_via_api, *credentials, ttl=USERS_TTL
+        )
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Failed to list users: {str(e)}")
+    return JSONResponse(content=users)
+
+
+@app.get("/api/servers/{server_id}/users/{username}")
+async def get_server_user(server_id: int, username: str):
+    credentials = _get_server_credentials(server_id)
+    try:
+        user_info = await coalescer.run(
+            (server_id, "user", username),
+            get_user_info_via_api,
+            *credentials,
+            username,
+            ttl=USERS_TTL,
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=502, detail=f"Failed to get user info: {str(e)}"
+        )
+    if user_info is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return JSONResponse(content=user_info)
+
+
+@app.get("/api/profiles/{username}")
+async def get_profile(
+    request: Request,
+    username: str,
+    format: str = "xray",
+    direct: Optional[str] = None,
+):
+    """Split-routing client profile covering all of a user's servers.
+
+    `direct` is a comma-separated list of geosite categories to bypass the
+    proxy; defaults to client_profiles.DEFAULT_DIRECT_SITES.
+    """
+    direct_sites = [site.strip() for site in direct.split(",")] if direct else None
+    try:
+        profile = get_client_profile(username, format, direct_sites)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if profile is None:
+        raise HTTPException(status_code=404, detail="User has no servers")
+
+    body, version = profile
+    headers = {"ETag": f'"{version}"', "X-Profile-Version": version}
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def _epoch(value):
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def _report_reader(start, end, server_id, hourly=False):
+    return RollupReader(
+        start=_epoch(start), end=_epoch(end), server_id=server_id, hourly=hourly
     )
-    server = cursor.fetchone()
-    conn.close()
-    if not server:
-        raise HTTPException(status_code=404, detail="Server not found")
 
-    traffic_data = get_traffic_usage(
-        server["server_ip"],
-        server["ssh_user"],
-        server["ssh_password"],
-        server["ssh_port"],
+
+@app.get("/api/reports/traffic")
+async def get_traffic_report(
+    group_by: str = "username",
+    bucket: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    server_id: Optional[int] = None,
+):
+    """Traffic totals from the hourly or daily rollups.
+
+    `group_by` is a comma-separated subset of server_id,username (empty for a
+    grand total) and `bucket` one of hour, day or month. Times are UTC.
+    """
+    columns = tuple(c.strip() for c in group_by.split(",") if c.strip())
+    reader = _report_reader(start, end, server_id, hourly=bucket == "hour")
+    try:
+        rows = await run_in_threadpool(usage_report, reader, columns, bucket)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse(content=rows)
+
+
+@app.get("/api/reports/traffic/top")
+async def get_top_users(
+    n: int = Query(default=10, ge=1, le=MAX_PAGE_SIZE),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    server_id: Optional[int] = None,
+):
+    reader = _report_reader(start, end, server_id)
+    return JSONResponse(content=await run_in_threadpool(top_users, reader, n))
+
+
+@app.get("/api/reports/traffic/rates")
+async def get_rate_percentiles(
+    percentiles: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    server_id: Optional[int] = None,
+):
+    try:
+        qs = (
+            tuple(float(q) for q in percentiles.split(","))
+            if percentiles
+            else DEFAULT_PERCENTILES
+        )
+        reader = _report_reader(start, end, server_id)
+        result = await run_in_threadpool(rate_percentiles, reader, qs)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse(content=result)
+
+
+@app.get("/api/reports/traffic/export")
+async def export_traffic(
+    format: str = "csv",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    server_id: Optional[int] = None,
+):
+    """Stream per-interval usage as CSV, Arrow IPC or Parquet."""
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown export format: {format}")
+    media_type, stream, needs_pyarrow = EXPORT_FORMATS[format]
+    if needs_pyarrow and not HAS_PYARROW:
+        raise HTTPException(
+            status_code=501, detail=f"{format} export requires pyarrow to be installed"
+        )
+    reader = SampleReader(start=_epoch(start), end=_epoch(end), server_id=server_id)
+    return StreamingResponse(
+        stream(reader),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="traffic.{format}"'},
     )
-    return JSONResponse(content=traffic_data)
+
+
+@app.get("/api/metrics/coalescing")
+async def get_coalescing_metrics():
+    return JSONResponse(content=coalescer.stats())
+
+
+@app.get("/api/metrics/mutations")
+async def get_mutation_metrics():
+    return JSONResponse(content=mutations.stats())
+
+
+def _require_admin(request: Request):
+    token = request.headers.get("x-admin-token", "")
+    # Compared as bytes: compare_digest rejects non-ASCII str with a TypeError.
+    if not ADMIN_TOKEN or not hmac.compare_digest(
+        token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")
+    ):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
+@app.post("/api/admin/profile")
+async def take_profile(
+    request: Request,
+    seconds: float = Query(default=10, gt=0, le=MAX_PROFILE_SECONDS),
+    interval_ms: float = Query(default=5, ge=1, le=1000),
+):
+    """Sample every thread for `seconds` and return a speedscope profile."""
+    _require_admin(request)
+    profile = await profile_for(seconds, interval_ms / 1000)
+    if profile is None:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    return JSONResponse(
+        content=profile,
+        headers={
+            "Content-Disposition": 'attachment; filename="profile.speedscope.json"'
+        },
+    )
+
+
+@app.put("/api/admin/tracing")
+async def configure_tracing(request: Request, sample_rate: float = Query(ge=0, le=1)):
+    """Trace this fraction of requests; 0 turns tracing off."""
+    _require_admin(request)
+    tracer.configure(sample_rate)
+    return {"sample_rate": tracer.sample_rate}
+
+
+@app.get("/api/admin/traces")
+async def get_traces(request: Request, limit: int = Query(default=50, ge=1, le=1000)):
+    _require_admin(request)
+    return JSONResponse(content=tracer.report(limit))
+
+
+@app.api_route("/static/{path:path}", methods=["GET", "HEAD"])
+async def serve_static(request: Request, path: str):
+    asset = static_assets.get(path)
+    if asset is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return static_assets.respond(asset, request)
 
 
 # Serve React App
-@app.get("/{full_path:path}")
+@app.api_route("/{full_path:path}", methods=["GET", "HEAD"])
 async def serve_react_app(request: Request, full_path: str):
-    return templates.TemplateResponse("index.html", {"request": request})
+    if static_assets.shell is None:
+        raise HTTPException(status_code=404, detail="Frontend build not found")
+    return static_assets.respond(static_assets.shell, request)
 
 
 if __name__ == "__main__":
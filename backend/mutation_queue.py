@@ -0,0 +1,303 @@
+import asyncio
+import uuid
+
+from api_client_manager import add_users_via_api, remove_users_via_api
+from registry import registry
+from request_coalescer import coalescer
+from starlette.concurrency import run_in_threadpool
+
+# Seconds to wait for more operations before a batch is sent to the server.
+BATCH_WINDOW = 0.05
+MAX_BATCH_SIZE = 500
+
+
+class ClientNotFound(LookupError):
+    pass
+
+
+class ClientExists(ValueError):
+    pass
+
+
+class _Operation:
+    __slots__ = ("kind", "username", "client_id", "future")
+
+    def __init__(self, kind, username=None, client_id=None):
+        self.kind = kind
+        self.username = username
+        self.client_id = client_id
+        self.future = asyncio.get_running_loop().create_future()
+
+    def resolve(self, result=None, error=None):
+        # The caller may have gone away; the operation still happened.
+        if self.future.done():
+            return
+        if error is not None:
+            self.future.set_exception(error)
+        else:
+            self.future.set_result(result)
+
+
+class MutationQueue:
+    """Serialized, micro-batched client adds and removes per server.
+
+    Operations for a server are applied by a single worker task, so they
+    never race on the host. Whatever arrives within BATCH_WINDOW is sent
+    as one `rmu` and one `adu` call, then committed to the registry in one
+    transaction, and each caller gets its own result or error. Different
+    servers have their own workers and run in parallel.
+
+    Every change to a host, batches and rebalancing moves alike, happens
+    while holding that server's lock.
+    """
+
+    def __init__(self, window=BATCH_WINDOW, max_batch_size=MAX_BATCH_SIZE):
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._pending = {}
+        self._workers = {}
+        self._locks = {}
+        self.metrics = {
+            "operations": 0,
+            "batches": 0,
+            "failed_batches": 0,
+            "moves": 0,
+        }
+
+    def _lock(self, server_id):
+        lock = self._locks.get(server_id)
+        if lock is None:
+            lock = self._locks[server_id] = asyncio.Lock()
+        return lock
+
+    async def add_client(self, server_id, username):
+        """Create a client; returns its ClientRecord."""
+        return await self._submit(server_id, _Operation("add", username=username))
+
+    async def delete_client(self, server_id, client_id):
+        """Remove a client; returns the deleted ClientRecord."""
+        return await self._submit(server_id, _Operation("delete", client_id=client_id))
+
+    async def _submit(self, server_id, operation):
+        self.metrics["operations"] += 1
+        self._pending.setdefault(server_id, []).append(operation)
+        if server_id not in self._workers:
+            self._workers[server_id] = asyncio.ensure_future(self._work(server_id))
+        return await operation.future
+
+    async def _work(self, server_id):
+        queue = self._pending[server_id]
+        while queue:
+            await asyncio.sleep(self.window)
+            batch = queue[: self.max_batch_size]
+            del queue[: self.max_batch_size]
+            try:
+                async with self._lock(server_id):
+                    await self._apply(server_id, batch)
+            except Exception as e:
+                self.metrics["failed_batches"] += 1
+                for operation in batch:
+                    operation.resolve(error=e)
+        # No await since the last emptiness check, so nothing can have been
+        # queued in between.
+        del self._pending[server_id]
+        del self._workers[server_id]
+
+    def _plan(self, server_id, batch):
+        """Split a batch into valid adds and deletes, rejecting the rest.
+
+        Operations are checked in arrival order against the registry plus
+        the batch's own earlier operations, so "delete alice, add alice"
+        works while two adds of the same name do not. Such an add depends on
+        the delete, which _apply checks before sending it.
+        """
+        adds, deletes = [], []
+        removed_ids, removed_names, added_names = set(), set(), set()
+        for operation in batch:
+            if operation.kind == "delete":
+                client = registry.get_client(operation.client_id)
+                if (
+                    not client
+                    or client.server_id != server_id
+                    or client.id in removed_ids
+                ):
+                    operation.resolve(error=ClientNotFound("Client not found"))
+                    continue
+                removed_ids.add(client.id)
+                removed_names.add(client.username)
+                deletes.append((operation, client))
+            else:
+                name = operation.username
+                existing = registry.get_client_by_name(server_id, name)
+                if name in added_names or (existing and name not in removed_names):
+                    operation.resolve(error=ClientExists("Client already exists"))
+                    continue
+                added_names.add(name)
+                adds.append((operation, str(uuid.uuid4())))
+        return adds, deletes
+
+    async def _apply(self, server_id, batch):
+        self.metrics["batches"] += 1
+        server = registry.get_server(server_id)
+        if not server:
+            for operation in batch:
+                operation.resolve(error=ClientNotFound("Server not found"))
+            return
+        adds, deletes = self._plan(server_id, batch)
+        if not adds and not deletes:
+            return
+
+        # Removals go first so a name deleted and re-added in one batch is
+        # free again by the time it is added.
+        committed_deletes = []
+        if deletes:
+            try:
+                await run_in_threadpool(
+                    remove_users_via_api,
+                    *server.credentials(),
+                    [client.username for _, client in deletes],
+                )
+                committed_deletes = deletes
+            except Exception as e:
+                for operation, _ in deletes:
+                    operation.resolve(error=e)
+                # Names whose removal failed are still taken.
+                still_taken = {client.username for _, client in deletes}
+                for operation, _ in adds:
+                    if operation.username in still_taken:
+                        operation.resolve(error=ClientExists("Client already exists"))
+                adds = [
+                    (operation, client_uuid)
+                    for operation, client_uuid in adds
+                    if operation.username not in still_taken
+                ]
+
+        committed_adds = []
+        if adds:
+            try:
+                await run_in_threadpool(
+                    add_users_via_api,
+                    *server.credentials(),
+                    [
+                        (operation.username, client_uuid)
+                        for operation, client_uuid in adds
+                    ],
+                )
+                committed_adds = adds
+            except Exception as e:
+                for operation, _ in adds:
+                    operation.resolve(error=e)
+
+        if not committed_adds and not committed_deletes:
+            return
+        # The server can be deleted while the remote calls run (re-provisioning
+        # deletes by IP without this lock); the registry re-checks it under its
+        # own lock so no orphaned clients are written.
+        changes = await run_in_threadpool(
+            registry.apply_client_changes,
+            server_id,
+            [
+                (client_uuid, operation.username)
+                for operation, client_uuid in committed_adds
+            ],
+            [client.id for _, client in committed_deletes],
+        )
+        coalescer.invalidate(server_id)
+        if changes is None:
+            for operation, _ in committed_adds + committed_deletes:
+                operation.resolve(error=ClientNotFound("Server not found"))
+            return
+        added, _ = changes
+        for (operation, _), client in zip(committed_adds, added):
+            operation.resolve(client)
+        for operation, client in committed_deletes:
+            operation.resolve(client)
+
+    async def move_clients(self, source_id, target_id, client_ids):
+        """Move clients to another server, keeping their ids and UUIDs.
+
+        Runs one `adu` on the target and one `rmu` on the source while
+        holding both servers' locks, so it never interleaves with queued
+        adds and removes on either host. Clients that left the source or
+        whose name is already taken on the target are skipped. Returns
+        {"source", "target", "moved": [client_id], "error"}.
+        """
+        self.metrics["moves"] += 1
+        result = {"source": source_id, "target": target_id, "moved": [], "error": None}
+        source = registry.get_server(source_id)
+        target = registry.get_server(target_id)
+        if not source or not target:
+            result["error"] = "Server not found"
+            return result
+
+        # Always lock in id order so two opposite moves can't deadlock.
+        first, second = sorted((source_id, target_id))
+        async with self._lock(first), self._lock(second):
+            # The plan may be stale by the time the locks are free.
+            if not registry.get_server(source_id) or not registry.get_server(target_id):
+                result["error"] = "Server not found"
+                return result
+            clients = []
+            for client_id in client_ids:
+                client = registry.get_client(client_id)
+                if (
+                    client
+                    and client.server_id == source_id
+                    and not registry.get_client_by_name(target_id, client.username)
+                ):
+                    clients.append(client)
+            if not clients:
+                return result
+
+            try:
+                await run_in_threadpool(
+                    add_users_via_api,
+                    *target.credentials(),
+                    [(client.username, client.uuid) for client in clients],
+                )
+            except Exception as e:
+                result["error"] = f"Failed to add users on target: {str(e)}"
+                return result
+
+            moved = await run_in_threadpool(
+                registry.move_clients, [client.id for client in clients], target_id
+            )
+            if moved is None:
+                result["error"] = "Server not found"
+                return result
+            result["moved"] = [client.id for client in moved]
+            coalescer.invalidate(source_id)
+            coalescer.invalidate(target_id)
+
+            try:
+                await run_in_threadpool(
+                    remove_users_via_api,
+                    *source.credentials(),
+                    [client.username for client in clients],
+                )
+            except Exception as e:
+                # The clients already live on the target; the stale source
+                # accounts only need a retry of the removal.
+                result["error"] = f"Failed to remove users from source: {str(e)}"
+        return result
+
+    async def delete_server(self, server_id, cleanup=None):
+        """Delete a server and its clients; returns the deleted ServerRecord.
+
+        Holds the server's lock, so a batch or move in progress finishes
+        first and operations still queued fail with "Server not found".
+        `cleanup(server)` runs in the threadpool before the records go.
+        """
+        async with self._lock(server_id):
+            server = registry.get_server(server_id)
+            if server and cleanup is not None:
+                await run_in_threadpool(cleanup, server)
+            deleted = await run_in_threadpool(registry.delete_server, server_id)
+            coalescer.invalidate(server_id)
+        return deleted
+
+    def stats(self):
+        return {**self.metrics, "active_servers": len(self._workers)}
+
+
+mutations = MutationQueue()
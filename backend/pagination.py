@@ -0,0 +1,75 @@
+import base64
+import hashlib
+import json
+
+from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse, Response
+from registry import registry
+
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(key) -> str:
+    raw = json.dumps(key, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def parse_fields(fields, allowed, default):
+    """Turn a `fields=a,b` query value into a tuple, rejecting unknown names."""
+    if not fields:
+        return default
+    requested = tuple(f.strip() for f in fields.split(",") if f.strip())
+    unknown = [f for f in requested if f not in allowed]
+    if unknown:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown fields: {', '.join(unknown)}"
+        )
+    return requested
+
+
+def list_response(request: Request, collection, version, since, fields, load_page):
+    """Build a list, 304 or delta response for a versioned collection.
+
+    `load_page()` returns (records, next_cursor) and is only called when the
+    client's ETag is stale. With `since`, returns the changes made after
+    that version instead, or 410 when they are no longer available.
+    """
+    if since is not None:
+        changes = registry.changes_since(collection, since)
+        if changes is None:
+            raise HTTPException(
+                status_code=410, detail="Version too old, refetch the full list"
+            )
+        for change in changes:
+            change["record"] = {
+                f: change["record"][f] for f in fields if f in change["record"]
+            }
+        if changes:
+            version = max(version, changes[-1]["version"])
+        return JSONResponse(
+            content={"version": version, "changes": changes},
+            headers={"X-Collection-Version": str(version)},
+        )
+
+    # The ETag covers the query too, so different pages/projections differ.
+    query = hashlib.sha1(str(sorted(request.query_params.multi_items())).encode())
+    etag = f'W/"{collection}-{version}-{query.hexdigest()[:12]}"'
+    headers = {"ETag": etag, "X-Collection-Version": str(version)}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+
+    records, next_cursor = load_page()
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = next_cursor
+    return JSONResponse(
+        content=[record.to_dict(fields) for record in records], headers=headers
+    )
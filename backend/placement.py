@@ -0,0 +1,275 @@
+import random
+import socket
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from registry import registry
+from traffic_parser import get_recent_rates
+
+DB_PATH = "vless_daddy.db"
+
+# Relative weights of the normalised load signals when scoring a server.
+RATE_WEIGHT = 1.0
+CLIENT_WEIGHT = 0.5
+LATENCY_WEIGHT = 0.25
+# A server more than this fraction above the fleet mean counts as hot.
+HOT_TOLERANCE = 0.2
+MAX_MOVES = 100
+PROBE_TTL = 60
+PROBE_TIMEOUT = 3
+
+_latency_cache = {}
+
+
+def probe_latency(server_ip: str, port: int = 443):
+    """TCP connect time to the proxy port in seconds, or None if unreachable.
+
+    Results are cached for PROBE_TTL seconds.
+    """
+    cached = _latency_cache.get(server_ip)
+    if cached and time.monotonic() - cached[0] < PROBE_TTL:
+        return cached[1]
+    started = time.monotonic()
+    try:
+        with socket.create_connection((server_ip, port), timeout=PROBE_TIMEOUT):
+            latency = time.monotonic() - started
+    except OSError:
+        latency = None
+    _latency_cache[server_ip] = (time.monotonic(), latency)
+    return latency
+
+
+def get_draining_servers() -> set:
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute("SELECT server_id FROM draining_servers")
+    draining = {row[0] for row in cursor.fetchall()}
+    conn.close()
+    return draining
+
+
+def set_draining(server_id: int, draining: bool) -> None:
+    conn = sqlite3.connect(DB_PATH)
+    if draining:
+        conn.execute(
+            "INSERT OR IGNORE INTO draining_servers (server_id) VALUES (?)",
+            (server_id,),
+        )
+    else:
+        conn.execute("DELETE FROM draining_servers WHERE server_id = ?", (server_id,))
+    conn.commit()
+    conn.close()
+
+
+def fleet_snapshot(probe: bool = True) -> dict:
+    """Collect per-server load signals.
+
+    Returns { server_id: {"clients": {client_id: rate}, "latency": float|None,
+    "draining": bool} }. Client rates come from the traffic samples that
+    traffic reads record; clients without samples get the fleet mean.
+    """
+    servers = registry.get_servers()
+    rates = get_recent_rates()
+    draining = get_draining_servers()
+    known = [rate for by_user in rates.values() for rate in by_user.values()]
+    default_rate = sum(known) / len(known) if known else 0.0
+
+    latencies = {}
+    if probe and servers:
+        with ThreadPoolExecutor(max_workers=min(16, len(servers))) as pool:
+            results = pool.map(lambda s: probe_latency(s.server_ip), servers)
+            latencies = dict(zip((s.id for s in servers), results))
+
+    snapshot = {}
+    for server in servers:
+        server_rates = rates.get(server.id, {})
+        snapshot[server.id] = {
+            "clients": {
+                client.id: server_rates.get(client.username, default_rate)
+                for client in registry.get_clients(server.id)
+            },
+            "latency": latencies.get(server.id, 0.0),
+            "draining": server.id in draining,
+        }
+    return snapshot
+
+
+def server_scores(snapshot):
+    """Lower is better. Unreachable and draining servers are not scored."""
+    candidates = {
+        server_id: info
+        for server_id, info in snapshot.items()
+        if not info["draining"] and info["latency"] is not None
+    }
+    if not candidates:
+        return {}
+    loads = {sid: sum(info["clients"].values()) for sid, info in candidates.items()}
+    counts = {sid: len(info["clients"]) for sid, info in candidates.items()}
+    max_load = max(loads.values()) or 1.0
+    max_count = max(counts.values()) or 1
+    max_latency = max(info["latency"] for info in candidates.values()) or 1.0
+    return {
+        sid: RATE_WEIGHT * loads[sid] / max_load
+        + CLIENT_WEIGHT * counts[sid] / max_count
+        + LATENCY_WEIGHT * candidates[sid]["latency"] / max_latency
+        for sid in candidates
+    }
+
+
+def choose_server(snapshot, username=None):
+    """Pick the server a new client should be placed on, or None."""
+    scores = server_scores(snapshot)
+    if username is not None:
+        # Xray keys users by email, so a name can only exist once per server.
+        scores = {
+            sid: score
+            for sid, score in scores.items()
+            if not registry.get_client_by_name(sid, username)
+        }
+    if not scores:
+        return None
+    return min(scores, key=scores.get)
+
+
+def plan_rebalance(
+    snapshot, usernames=None, tolerance=HOT_TOLERANCE, max_moves=MAX_MOVES
+):
+    """Greedily plan client moves off draining and hot servers.
+
+    Returns a list of (client_id, source_server_id, target_server_id).
+    `usernames` maps client_id -> username and is used to avoid placing a
+    user on a server that already has that name; pass None to skip the check.
+    """
+    loads = {sid: sum(info["clients"].values()) for sid, info in snapshot.items()}
+    clients = {sid: dict(info["clients"]) for sid, info in snapshot.items()}
+    names = {
+        sid: {usernames[cid] for cid in info["clients"]} if usernames else set()
+        for sid, info in snapshot.items()
+    }
+    targets = [
+        sid
+        for sid, info in snapshot.items()
+        if not info["draining"] and info["latency"] is not None
+    ]
+    if not targets:
+        return []
+    moves = []
+
+    def move(client_id, source, target):
+        rate = clients[source].pop(client_id)
+        clients[target][client_id] = rate
+        loads[source] -= rate
+        loads[target] += rate
+        if usernames:
+            names[source].discard(usernames[client_id])
+            names[target].add(usernames[client_id])
+        moves.append((client_id, source, target))
+
+    def allowed(client_id, target):
+        return not usernames or usernames[client_id] not in names[target]
+
+    # Everything leaves draining servers, heaviest clients first.
+    for source in [sid for sid, info in snapshot.items() if info["draining"]]:
+        heaviest_first = sorted(clients[source], key=clients[source].get, reverse=True)
+        for client_id in heaviest_first:
+            if len(moves) >= max_moves:
+                return moves
+            options = [t for t in targets if allowed(client_id, t)]
+            if options:
+                move(client_id, source, min(options, key=loads.get))
+
+    # Then shave hot servers towards the mean, one client at a time.
+    mean = sum(loads[t] for t in targets) / len(targets)
+    while len(moves) < max_moves:
+        hot = max(targets, key=loads.get)
+        cold = min(targets, key=loads.get)
+        gap = loads[hot] - loads[cold]
+        if loads[hot] <= mean * (1 + tolerance) or gap <= 0:
+            break
+        # The client closest to half the gap evens the pair out best; anything
+        # at or above the full gap would just swap which server is hot.
+        fitting = [
+            cid
+            for cid, rate in clients[hot].items()
+            if 0 < rate < gap and allowed(cid, cold)
+        ]
+        if not fitting:
+            break
+        best = min(fitting, key=lambda cid: abs(clients[hot][cid] - gap / 2))
+        move(best, hot, cold)
+    return moves
+
+
+def group_moves(moves):
+    """Group planned moves into {(source, target): [client_id]} batches.
+
+    A client may be moved more than once in a plan; only its first source
+    and last target matter, and clients that end where they started are
+    left out.
+    """
+    endpoints = {}
+    for client_id, source, target in moves:
+        origin = endpoints[client_id][0] if client_id in endpoints else source
+        endpoints[client_id] = (origin, target)
+
+    batches = {}
+    for client_id, (source, target) in endpoints.items():
+        if source != target:
+            batches.setdefault((source, target), []).append(client_id)
+    return batches
+
+
+def simulate(n_servers=20, n_clients=2000, seed=0):
+    """Compare peak server load of hand placement vs the scheduler.
+
+    Client rates follow a heavy-tailed distribution. "Hand" placement
+    favours the first servers an operator sees, mimicking manual picks.
+    Returns the peak-to-mean load ratio for hand placement, scheduler
+    placement, and hand placement after one rebalance.
+    """
+    rng = random.Random(seed)
+    rates = [rng.paretovariate(1.5) for _ in range(n_clients)]
+    weights = [1 / (i + 1) for i in range(n_servers)]
+
+    def empty_fleet():
+        return {
+            sid: {"clients": {}, "latency": rng.uniform(0.02, 0.2), "draining": False}
+            for sid in range(n_servers)
+        }
+
+    def peak_ratio(fleet):
+        loads = [sum(info["clients"].values()) for info in fleet.values()]
+        return max(loads) / (sum(loads) / len(loads))
+
+    hand = empty_fleet()
+    for cid, rate in enumerate(rates):
+        hand[rng.choices(range(n_servers), weights)[0]]["clients"][cid] = rate
+
+    scheduled = empty_fleet()
+    for cid, rate in enumerate(rates):
+        scheduled[choose_server(scheduled)]["clients"][cid] = rate
+
+    rebalanced = {
+        sid: dict(info, clients=dict(info["clients"])) for sid, info in hand.items()
+    }
+    for cid, source, target in plan_rebalance(rebalanced, max_moves=n_clients):
+        rebalanced[target]["clients"][cid] = rebalanced[source]["clients"].pop(cid)
+
+    return {
+        "hand": peak_ratio(hand),
+        "scheduled": peak_ratio(scheduled),
+        "rebalanced": peak_ratio(rebalanced),
+    }
+
+
+if __name__ == "__main__":
+    for n_servers, n_clients in ((5, 200), (20, 2000), (50, 5000)):
+        started = time.perf_counter()
+        result = simulate(n_servers, n_clients)
+        print(
+            f"{n_servers} servers / {n_clients} clients: peak/mean load "
+            f"hand={result['hand']:.2f} scheduled={result['scheduled']:.2f} "
+            f"rebalanced={result['rebalanced']:.2f} "
+            f"({time.perf_counter() - started:.2f}s)"
+        )
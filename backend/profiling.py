@@ -0,0 +1,398 @@
+import asyncio
+import contextvars
+import random
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+
+import paramiko
+from paramiko.sftp_file import SFTPFile
+
+MAX_PROFILE_SECONDS = 120
+DEFAULT_SAMPLE_INTERVAL = 0.005
+MAX_TRACES = 200
+MAX_SPANS_PER_TRACE = 1000
+DETAIL_LENGTH = 120
+LAG_INTERVAL = 0.5
+LAG_WINDOW = 120
+
+# The trace of the request being handled, if it was sampled. Starlette's
+# threadpool and asyncio tasks copy the context, so spans recorded in
+# worker threads land on the right request.
+_current_trace = contextvars.ContextVar("vless_daddy_trace", default=None)
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    __slots__ = ("method", "path", "status", "started_at", "start", "duration", "spans")
+
+    def __init__(self, method, path):
+        self.method = method
+        self.path = path
+        self.status = None
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.duration = None
+        self.spans = []
+
+    def add_span(self, kind, detail, start, duration):
+        if len(self.spans) < MAX_SPANS_PER_TRACE:
+            self.spans.append(
+                {
+                    "kind": kind,
+                    "detail": detail[:DETAIL_LENGTH],
+                    "start": start - self.start,
+                    "duration": duration,
+                    "thread": threading.current_thread().name,
+                }
+            )
+
+    def to_dict(self):
+        totals = {}
+        for span in self.spans:
+            totals[span["kind"]] = totals.get(span["kind"], 0.0) + span["duration"]
+        return {
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "started_at": self.started_at,
+            "duration": self.duration,
+            "time_by_kind": totals,
+            "spans": self.spans,
+        }
+
+
+class _Span:
+    __slots__ = ("trace", "kind", "detail", "start")
+
+    def __init__(self, trace, kind, detail):
+        self.trace = trace
+        self.kind = kind
+        self.detail = detail
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.add_span(
+            self.kind, self.detail, self.start, time.perf_counter() - self.start
+        )
+        return False
+
+
+def span(kind, detail=""):
+    """Time a block as part of the current request's trace.
+
+    Costs a single context variable lookup when the request isn't traced.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return _NOOP_SPAN
+    return _Span(trace, kind, str(detail))
+
+
+class _TracedCursor(sqlite3.Cursor):
+    def execute(self, sql, *args):
+        with span("db.query", sql):
+            return super().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        with span("db.query", sql):
+            return super().executemany(sql, *args)
+
+
+class _TracedConnection(sqlite3.Connection):
+    def cursor(self, factory=_TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, *args):
+        with span("db.query", sql):
+            return super().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        with span("db.query", sql):
+            return super().executemany(sql, *args)
+
+
+class _Instrumentation:
+    """Wraps paramiko and sqlite3 entry points while tracing is on.
+
+    The originals are restored when tracing is turned off, so the disabled
+    path runs the libraries untouched.
+    """
+
+    def __init__(self):
+        self._originals = None
+
+    def install(self):
+        if self._originals is not None:
+            return
+        connect = paramiko.SSHClient.connect
+        exec_command = paramiko.Channel.exec_command
+        recv_exit_status = paramiko.Channel.recv_exit_status
+        sftp_write = SFTPFile.write
+        sqlite_connect = sqlite3.connect
+
+        def traced_connect(client, hostname, *args, **kwargs):
+            with span("ssh.connect", hostname):
+                return connect(client, hostname, *args, **kwargs)
+
+        def traced_exec_command(channel, command):
+            trace = _current_trace.get()
+            if trace is not None:
+                # The command runs until its exit status is read, so the span
+                # is closed in recv_exit_status rather than here.
+                channel._vless_daddy_span = (trace, command, time.perf_counter())
+            return exec_command(channel, command)
+
+        def traced_recv_exit_status(channel):
+            status = recv_exit_status(channel)
+            pending = getattr(channel, "_vless_daddy_span", None)
+            if pending is not None:
+                channel._vless_daddy_span = None
+                trace, command, start = pending
+                trace.add_span("ssh.exec", command, start, time.perf_counter() - start)
+            return status
+
+        def traced_sftp_write(sftp_file, data):
+            with span("sftp.write", f"{len(data)} bytes"):
+                return sftp_write(sftp_file, data)
+
+        def traced_sqlite_connect(*args, **kwargs):
+            kwargs.setdefault("factory", _TracedConnection)
+            return sqlite_connect(*args, **kwargs)
+
+        paramiko.SSHClient.connect = traced_connect
+        paramiko.Channel.exec_command = traced_exec_command
+        paramiko.Channel.recv_exit_status = traced_recv_exit_status
+        SFTPFile.write = traced_sftp_write
+        sqlite3.connect = traced_sqlite_connect
+        self._originals = (
+            connect,
+            exec_command,
+            recv_exit_status,
+            sftp_write,
+            sqlite_connect,
+        )
+
+    def uninstall(self):
+        if self._originals is None:
+            return
+        (
+            paramiko.SSHClient.connect,
+            paramiko.Channel.exec_command,
+            paramiko.Channel.recv_exit_status,
+            SFTPFile.write,
+            sqlite3.connect,
+        ) = self._originals
+        self._originals = None
+
+
+class Tracer:
+    """Samples a fraction of requests into traces and watches loop lag."""
+
+    def __init__(self):
+        self.sample_rate = 0.0
+        self.traces = deque(maxlen=MAX_TRACES)
+        self.loop_lag = deque(maxlen=LAG_WINDOW)
+        self._instrumentation = _Instrumentation()
+        self._lag_task = None
+
+    def configure(self, sample_rate):
+        """Trace `sample_rate` (0..1) of requests; 0 turns tracing off."""
+        self.sample_rate = sample_rate
+        if sample_rate > 0:
+            self._instrumentation.install()
+            if self._lag_task is None:
+                self._lag_task = asyncio.ensure_future(self._watch_loop_lag())
+        else:
+            self._instrumentation.uninstall()
+            if self._lag_task is not None:
+                self._lag_task.cancel()
+                self._lag_task = None
+
+    async def _watch_loop_lag(self):
+        # Anything blocking the loop delays this wakeup by the same amount.
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(LAG_INTERVAL)
+            self.loop_lag.append(max(0.0, loop.time() - started - LAG_INTERVAL))
+
+    def should_trace(self):
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def lag_stats(self):
+        if not self.loop_lag:
+            return {"samples": 0}
+        lags = list(self.loop_lag)
+        return {
+            "samples": len(lags),
+            "last": lags[-1],
+            "mean": sum(lags) / len(lags),
+            "max": max(lags),
+        }
+
+    def report(self, limit=50):
+        return {
+            "sample_rate": self.sample_rate,
+            "loop_lag": self.lag_stats(),
+            "traces": [trace.to_dict() for trace in list(self.traces)[-limit:]],
+        }
+
+
+tracer = Tracer()
+
+
+class TracingMiddleware:
+    """ASGI middleware that opens a trace for sampled HTTP requests.
+
+    Unsampled requests pass straight through to the app.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not tracer.should_trace():
+            return await self.app(scope, receive, send)
+
+        trace = Trace(scope["method"], scope["path"])
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                trace.status = message["status"]
+            await send(message)
+
+        token = _current_trace.set(trace)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _current_trace.reset(token)
+            trace.duration = time.perf_counter() - trace.start
+            tracer.traces.append(trace)
+
+
+class SamplingProfiler:
+    """Statistical profiler that samples every thread's stack.
+
+    A background thread reads sys._current_frames() every `interval`
+    seconds, so profiled code runs unmodified. Results export to the
+    speedscope format (https://www.speedscope.app).
+    """
+
+    def __init__(self, interval=DEFAULT_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.frames = {}
+        self.samples = {}
+        self.duration = 0.0
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._sample, name="sampling-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _frame_index(self, code):
+        key = (code.co_name, code.co_filename, code.co_firstlineno)
+        index = self.frames.get(key)
+        if index is None:
+            index = self.frames[key] = len(self.frames)
+        return index
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        started = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._frame_index(frame.f_code))
+                    frame = frame.f_back
+                stack.reverse()
+                by_stack = self.samples.setdefault(
+                    names.get(thread_id, str(thread_id)), {}
+                )
+                key = tuple(stack)
+                by_stack[key] = by_stack.get(key, 0) + 1
+        self.duration = time.perf_counter() - started
+
+    def to_speedscope(self, name="vless-daddy"):
+        frames = [None] * len(self.frames)
+        for (func, filename, line), index in self.frames.items():
+            frames[index] = {"name": func, "file": filename, "line": line}
+        profiles = []
+        for thread_name, by_stack in sorted(self.samples.items()):
+            stacks = list(by_stack)
+            weights = [by_stack[stack] * self.interval for stack in stacks]
+            profiles.append(
+                {
+                    "type": "sampled",
+                    "name": thread_name,
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": sum(weights),
+                    "samples": [list(stack) for stack in stacks],
+                    "weights": weights,
+                }
+            )
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "vless-daddy",
+            "shared": {"frames": frames},
+            "profiles": profiles,
+        }
+
+
+_profiling = False
+
+
+async def profile_for(seconds, interval=DEFAULT_SAMPLE_INTERVAL):
+    """Sample all threads for `seconds` and return a speedscope document.
+
+    Returns None if a profile is already being taken.
+    """
+    global _profiling
+    if _profiling:
+        return None
+    _profiling = True
+    try:
+        profiler = SamplingProfiler(interval)
+        profiler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            await asyncio.get_running_loop().run_in_executor(None, profiler.stop)
+        return profiler.to_speedscope(f"vless-daddy {seconds:g}s")
+    finally:
+        _profiling = False
@@ -0,0 +1,289 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+
+from proxy_creator import STAGES, create_proxy_stream
+
+DB_PATH = "vless_daddy.db"
+WORKER_COUNT = 2
+POLL_INTERVAL = 0.5
+# Finished jobs (and their event logs) are kept this long, then deleted.
+JOB_RETENTION = 7 * 24 * 3600
+PRUNE_INTERVAL = 3600
+
+_wakeup = threading.Event()
+_workers = []
+
+
+def _connect():
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def enqueue_job(
+    server_ip, ssh_user, ssh_password, ssh_port, mask_domain, proxy_name, overwrite
+) -> int:
+    """Store a new provisioning job and wake a worker. Returns the job id."""
+    now = time.time()
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        INSERT INTO provision_jobs (server_ip, ssh_user, ssh_password, ssh_port,
+            mask_domain, proxy_name, overwrite, status, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, 'queued', ?, ?)
+    """,
+        (
+            server_ip,
+            ssh_user,
+            ssh_password,
+            ssh_port,
+            mask_domain,
+            proxy_name,
+            int(bool(overwrite)),
+            now,
+            now,
+        ),
+    )
+    job_id = cursor.lastrowid
+    conn.commit()
+    conn.close()
+    _wakeup.set()
+    return job_id
+
+
+def get_job(job_id: int):
+    """Return a job's public state (no credentials) or None."""
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM provision_jobs WHERE id = ?", (job_id,))
+    row = cursor.fetchone()
+    cursor.execute(
+        "SELECT COALESCE(MAX(seq), 0) FROM provision_job_events WHERE job_id = ?",
+        (job_id,),
+    )
+    last_seq = cursor.fetchone()[0]
+    conn.close()
+    if not row:
+        return None
+    checkpoint = json.loads(row["checkpoint"])
+    return {
+        "id": row["id"],
+        "server_ip": row["server_ip"],
+        "proxy_name": row["proxy_name"],
+        "status": row["status"],
+        "completed_stages": [stage for stage in STAGES if stage in checkpoint],
+        "attempts": row["attempts"],
+        "events": last_seq,
+        "error": row["error"],
+        "result": json.loads(row["result"]) if row["result"] else None,
+        "created_at": row["created_at"],
+        "updated_at": row["updated_at"],
+    }
+
+
+def retry_job(job_id: int, overwrite=None) -> bool:
+    """Requeue a failed job, keeping the stages it already completed."""
+    conn = _connect()
+    cursor = conn.cursor()
+    if overwrite is None:
+        cursor.execute(
+            "UPDATE provision_jobs SET status = 'queued', error = NULL, updated_at = ? WHERE id = ? AND status = 'failed'",
+            (time.time(), job_id),
+        )
+    else:
+        cursor.execute(
+            "UPDATE provision_jobs SET status = 'queued', error = NULL, overwrite = ?, updated_at = ? WHERE id = ? AND status = 'failed'",
+            (int(bool(overwrite)), time.time(), job_id),
+        )
+    requeued = cursor.rowcount == 1
+    conn.commit()
+    conn.close()
+    if requeued:
+        _wakeup.set()
+    return requeued
+
+
+def _append_event(cursor, job_id, message):
+    cursor.execute(
+        """
+        INSERT INTO provision_job_events (job_id, seq, message)
+        SELECT ?, COALESCE(MAX(seq), 0) + 1, ? FROM provision_job_events WHERE job_id = ?
+    """,
+        (job_id, message, job_id),
+    )
+
+
+def _claim_next_job():
+    """Atomically move the oldest queued job to running and return it."""
+    conn = _connect()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute(
+            "SELECT * FROM provision_jobs WHERE status = 'queued' ORDER BY id LIMIT 1"
+        )
+        row = cursor.fetchone()
+        if row:
+            cursor.execute(
+                "UPDATE provision_jobs SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (time.time(), row["id"]),
+            )
+        conn.commit()
+        return row
+    finally:
+        conn.close()
+
+
+def _run_job(job):
+    job_id = job["id"]
+    checkpoint = json.loads(job["checkpoint"])
+    status, result, error = "failed", None, "Provisioning ended unexpectedly"
+
+    conn = _connect()
+    cursor = conn.cursor()
+    try:
+        for message in create_proxy_stream(
+            job["server_ip"],
+            job["ssh_user"],
+            job["ssh_password"],
+            job["ssh_port"],
+            job["mask_domain"],
+            job["proxy_name"],
+            overwrite=bool(job["overwrite"]),
+            checkpoint=checkpoint,
+        ):
+            if message.startswith("result:"):
+                status, result, error = "completed", message[len("result:") :], None
+            elif message.startswith("error:"):
+                error = message[len("error:") :]
+            # Persist the checkpoint together with the event that reports it.
+            _append_event(cursor, job_id, message)
+            cursor.execute(
+                "UPDATE provision_jobs SET checkpoint = ?, updated_at = ? WHERE id = ?",
+                (json.dumps(checkpoint), time.time(), job_id),
+            )
+            conn.commit()
+    except Exception as e:
+        error = str(e)
+        _append_event(cursor, job_id, f"error:{error}")
+    finally:
+        cursor.execute(
+            "UPDATE provision_jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ?",
+            (status, result, error, time.time(), job_id),
+        )
+        if status == "completed":
+            # A completed job is never retried, so it no longer needs the
+            # SSH password or the Reality private key; the server row keeps
+            # what it needs and the key lives only in the host's config.
+            checkpoint.get("keys", {}).pop("private_key", None)
+            cursor.execute(
+                "UPDATE provision_jobs SET ssh_password = '', checkpoint = ? WHERE id = ?",
+                (json.dumps(checkpoint), job_id),
+            )
+        conn.commit()
+        conn.close()
+
+
+def prune_jobs(retention=JOB_RETENTION):
+    """Delete jobs that finished more than `retention` seconds ago.
+
+    Returns the number of jobs removed. Failed jobs keep their credentials
+    for retries until they are pruned.
+    """
+    cutoff = time.time() - retention
+    conn = _connect()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute(
+            """
+            DELETE FROM provision_job_events WHERE job_id IN (
+                SELECT id FROM provision_jobs
+                WHERE status IN ('completed', 'failed') AND updated_at < ?
+            )
+        """,
+            (cutoff,),
+        )
+        cursor.execute(
+            "DELETE FROM provision_jobs WHERE status IN ('completed', 'failed') AND updated_at < ?",
+            (cutoff,),
+        )
+        pruned = cursor.rowcount
+        conn.commit()
+        return pruned
+    finally:
+        conn.close()
+
+
+def _worker_loop():
+    last_prune = 0.0
+    while True:
+        job = _claim_next_job()
+        if job is None:
+            if time.time() - last_prune > PRUNE_INTERVAL:
+                last_prune = time.time()
+                try:
+                    prune_jobs()
+                except Exception as e:
+                    print(f"ERROR: pruning provisioning jobs failed: {str(e)}")
+            _wakeup.wait(timeout=5)
+            _wakeup.clear()
+            continue
+        try:
+            _run_job(job)
+        except Exception as e:
+            print(f"ERROR: provisioning job {job['id']} crashed: {str(e)}")
+
+
+def start_workers():
+    """Requeue jobs interrupted by a restart and start the worker threads."""
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(
+        "UPDATE provision_jobs SET status = 'queued', updated_at = ? WHERE status = 'running'",
+        (time.time(),),
+    )
+    conn.commit()
+    conn.close()
+
+    while len(_workers) < WORKER_COUNT:
+        worker = threading.Thread(target=_worker_loop, daemon=True)
+        worker.start()
+        _workers.append(worker)
+    _wakeup.set()
+
+
+def _fetch_events(job_id, after):
+    conn = _connect()
+    cursor = conn.cursor()
+    # Read the status first: events are committed before the job settles, so a
+    # settled status guarantees the event query below sees the final lines.
+    cursor.execute("SELECT status FROM provision_jobs WHERE id = ?", (job_id,))
+    status = cursor.fetchone()["status"]
+    cursor.execute(
+        "SELECT seq, message FROM provision_job_events WHERE job_id = ? AND seq > ? ORDER BY seq",
+        (job_id, after),
+    )
+    events = cursor.fetchall()
+    conn.close()
+    return events, status
+
+
+async def stream_job_events(job_id: int, after: int = 0):
+    """Yield a job's progress lines from `after` on until the job settles.
+
+    Reattaching clients pass the last seq they saw to pick up where they
+    left off; the job itself keeps running whether anyone listens or not.
+    """
+    while True:
+        events, status = await asyncio.to_thread(_fetch_events, job_id, after)
+        for seq, message in events:
+            after = seq
+            yield f"{message}\n"
+        if status in ("completed", "failed"):
+            return
+        await asyncio.sleep(POLL_INTERVAL)
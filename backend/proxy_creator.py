@@ -1,31 +1,185 @@
 import base64
 import io
 import json
-import sqlite3
 import uuid
 
 import paramiko
 import pyqrcode
+from config_compiler import (
+    DEFAULT_USER,
+    RealityClient,
+    ServerConfig,
+    compile_config,
+    generate_reality_keys,
+    generate_short_id,
+)
 from proxy_verifier import verify_proxy
+from registry import registry
+from remote_script import heredoc, marker, render_script, run_script
 
 
-def execute_command(ssh_client, command):
-    stdin, stdout, stderr = ssh_client.exec_command(command)
-    exit_status = stdout.channel.recv_exit_status()
-    if exit_status != 0:
-        error_message = stderr.read().decode("utf-8")
-        raise Exception(
-            f"Command '{command}' failed with exit status {exit_status}: {error_message}"
+def server_config(mask_domain, keys):
+    """The config model for a server provisioned with `keys`."""
+    return ServerConfig(
+        mask_domain=mask_domain,
+        private_key=keys["private_key"],
+        clients=(RealityClient(id=keys["uuid"], email=DEFAULT_USER),),
+        # Jobs checkpointed before short IDs were generated use the empty one.
+        short_ids=(keys.get("short_id", ""),),
+    )
+
+
+def _new_keys():
+    private_key, public_key = generate_reality_keys()
+    return {
+        "uuid": str(uuid.uuid4()),
+        "private_key": private_key,
+        "public_key": public_key,
+        "short_id": generate_short_id(),
+    }
+
+
+def _save_server(
+    server_ip,
+    ssh_user,
+    ssh_password,
+    ssh_port,
+    mask_domain,
+    public_key,
+    proxy_name,
+    default_uuid,
+    short_id,
+):
+    server = registry.add_server(
+        server_ip,
+        ssh_user,
+        ssh_password,
+        ssh_port,
+        mask_domain,
+        public_key,
+        proxy_name,
+        short_id,
+    )
+    registry.add_client(server.id, default_uuid, DEFAULT_USER)
+    return server.id
+
+
+STAGES = ("connect", "cleanup", "install", "keys", "config", "verify", "done")
+
+REMOTE_CONFIG_PATH = "/usr/local/etc/xray/config.json"
+CLEANUP_COMMAND = (
+    "systemctl stop xray; rm -f /usr/local/etc/xray/config.json; rm -rf /var/log/xray"
+)
+# Ensure curl is installed (needed for Xray install script), then install Xray
+INSTALL_COMMANDS = (
+    "command -v curl >/dev/null 2>&1 || (apt-get update && apt-get install -y curl)",
+    'bash -c "$(curl -L https://github.com/XTLS/Xray-install/raw/main/install-release.sh)" @ install',
+)
+LOG_SETUP_COMMAND = "mkdir -p /var/log/xray && touch /var/log/xray/access.log /var/log/xray/error.log && chown nobody:nogroup /var/log/xray/*.log && chmod 644 /var/log/xray/*.log"
+RESTART_COMMANDS = ("systemctl restart xray", "systemctl status xray")
+
+
+def _config_unchanged(digest):
+    """Shell test: the host already runs exactly the config hashing to `digest`."""
+    return (
+        f"[ \"$(sha256sum {REMOTE_CONFIG_PATH} 2>/dev/null | cut -d' ' -f1)\" = {digest} ]"
+        " && systemctl is-active --quiet xray"
+    )
+
+
+def render_provision_script(overwrite, checkpoint, compiled):
+    """Render the outstanding cleanup..config stages as one shell script.
+
+    `compiled` is the (json_text, sha256) of the server config. Returns None
+    when nothing is left to do remotely. Progress is reported through
+    remote_script markers: `status:<stage>:<state>`, `checkpoint:<stage>`
+    and `exists`.
+    """
+    sections = []
+    if "cleanup" not in checkpoint:
+        if overwrite:
+            # Nothing may be installed yet, so cleanup failures are expected.
+            sections += [
+                "set +e",
+                CLEANUP_COMMAND,
+                "set -e",
+                marker("status", "cleanup", "done"),
+            ]
+        else:
+            sections.append(
+                f"if [ -f {REMOTE_CONFIG_PATH} ]; then {marker('exists')}; exit 0; fi"
+            )
+            sections.append(marker("checkpoint", "cleanup"))
+
+    if "install" not in checkpoint:
+        sections += [
+            marker("status", "install", "inprogress"),
+            *INSTALL_COMMANDS,
+            marker("status", "install", "done"),
+        ]
+
+    if "keys" not in checkpoint:
+        sections += [
+            marker("status", "keys", "inprogress"),
+            LOG_SETUP_COMMAND,
+            marker("status", "keys", "done"),
+        ]
+
+    if "config" not in checkpoint:
+        text, digest = compiled
+        staged_path = f"{REMOTE_CONFIG_PATH}.new"
+        # An identical running config is neither re-uploaded nor restarted.
+        update = "\n".join(
+            [
+                f"if ! {{ {_config_unchanged(digest)}; }}; then",
+                heredoc(staged_path, text),
+                f"mv {staged_path} {REMOTE_CONFIG_PATH}",
+                *RESTART_COMMANDS,
+                "fi",
+            ]
         )
-    return stdout.read().decode("utf-8")
+        sections += [
+            marker("status", "config", "inprogress"),
+            update,
+            marker("status", "config", "done"),
+        ]
 
+    if not sections:
+        return None
+    return render_script(sections)
 
-def file_exists(sftp_client, path):
-    try:
-        sftp_client.stat(path)
-        return True
-    except FileNotFoundError:
-        return False
+
+def _remote_stages_script(ssh_client, overwrite, checkpoint, keys, compiled):
+    """Run cleanup..config as one uploaded script over a single channel.
+
+    The number of round trips no longer depends on the number of steps.
+    Returns False if provisioning must stop (existing config, no overwrite).
+    """
+    script = render_provision_script(overwrite, checkpoint, compiled)
+    stage_data = {"keys": keys, "config": {"sha256": compiled[1]}}
+    reported = set()
+    if script is not None:
+        if overwrite and "cleanup" not in checkpoint:
+            yield "status:cleanup:inprogress"
+        for event in run_script(ssh_client, script):
+            kind, _, rest = event.partition(":")
+            if kind == "exists":
+                yield "error:exists"
+                return False
+            if kind == "checkpoint":
+                checkpoint[rest] = {}
+            elif kind == "status":
+                stage, _, state = rest.partition(":")
+                if state == "done":
+                    checkpoint[stage] = stage_data.get(stage, {})
+                    reported.add(stage)
+                yield event
+
+    # Report stages finished on an earlier attempt as done too.
+    for stage in ("install", "keys", "config"):
+        if stage not in reported:
+            yield f"status:{stage}:done"
+    return True
 
 
 def create_proxy_stream(
@@ -36,195 +190,61 @@ def create_proxy_stream(
     mask_domain,
     proxy_name,
     overwrite: bool = False,
+    checkpoint: dict = None,
 ):
+    """Provision Xray on a host, yielding `status:<stage>:<state>` events.
+
+    `checkpoint` maps completed stages to the data they produced. Stages
+    already in it are skipped, and each newly completed stage is recorded
+    before its `done` event is yielded, so a caller can persist it and
+    resume an interrupted run without redoing e.g. the install.
+    """
+    if checkpoint is None:
+        checkpoint = {}
+
     ssh_client = paramiko.SSHClient()
     ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
 
     try:
+        # Keys and config are produced and validated locally, so a bad
+        # config fails here rather than when Xray restarts on the host.
+        keys = checkpoint.get("keys") or _new_keys()
+        compiled = compile_config(server_config(mask_domain, keys))
+
         yield "status:connect:inprogress"
         ssh_client.connect(
             hostname=server_ip, username=ssh_user, password=ssh_password, port=ssh_port
         )
+        checkpoint["connect"] = {}
         yield "status:connect:done"
 
-        sftp = ssh_client.open_sftp()
-        try:
-            config_exists = file_exists(sftp, "/usr/local/etc/xray/config.json")
-        finally:
-            sftp.close()
+        # Always clean up DB entries by IP if overwriting
+        if overwrite and "cleanup" not in checkpoint:
+            registry.delete_servers_by_ip(server_ip)
 
-        if config_exists and not overwrite:
-            yield "error:exists"
+        completed = yield from _remote_stages_script(
+            ssh_client, overwrite, checkpoint, keys, compiled
+        )
+        if not completed:
             return
 
-        # Always clean up DB entries by IP if overwriting
-        if overwrite:
-            yield "status:cleanup:inprogress"
+        generated_uuid = checkpoint["keys"]["uuid"]
+        public_key = checkpoint["keys"]["public_key"]
+        short_id = checkpoint["keys"].get("short_id", "")
 
-            # First, clean up local database entries based on IP
-            conn = sqlite3.connect("vless_daddy.db")
-            cursor = conn.cursor()
-            try:
-                # Find all server IDs matching the IP address
-                cursor.execute(
-                    "SELECT id FROM servers WHERE server_ip = ?", (server_ip,)
+        if "verify" not in checkpoint:
+            yield "status:verify:inprogress"
+            verified = verify_proxy(server_ip, mask_domain)
+            if not verified:
+                raise Exception(
+                    "Proxy verification failed. The server may not be reachable or is misconfigured."
                 )
-                server_rows = cursor.fetchall()
-                server_ids = [row[0] for row in server_rows]
-
-                if server_ids:
-                    # Use placeholders for safe deletion
-                    placeholders = ",".join("?" for _ in server_ids)
-                    # Delete all clients associated with these servers
-                    cursor.execute(
-                        f"DELETE FROM clients WHERE server_id IN ({placeholders})",
-                        server_ids,
-                    )
-                    # Delete all servers matching the IP
-                    cursor.execute(
-                        "DELETE FROM servers WHERE server_ip = ?", (server_ip,)
-                    )
-
-                conn.commit()
-            finally:
-                conn.close()
-
-            # Second, clean up the remote server
-            cleanup_command = "systemctl stop xray; rm -f /usr/local/etc/xray/config.json; rm -rf /var/log/xray"
-            execute_command(ssh_client, cleanup_command)
-
-            yield "status:cleanup:done"
-
-        yield "status:install:inprogress"
-        # Ensure curl is installed (needed for Xray install script)
-        check_curl_command = "command -v curl >/dev/null 2>&1 || (apt-get update && apt-get install -y curl)"
-        execute_command(ssh_client, check_curl_command)
-
-        install_command = 'bash -c "$(curl -L https://github.com/XTLS/Xray-install/raw/main/install-release.sh)" @ install'
-        execute_command(ssh_client, install_command)
-        yield "status:install:done"
-
-        yield "status:keys:inprogress"
-        log_setup_command = "mkdir -p /var/log/xray && touch /var/log/xray/access.log /var/log/xray/error.log && chown nobody:nogroup /var/log/xray/*.log && chmod 644 /var/log/xray/*.log"
-        execute_command(ssh_client, log_setup_command)
-
-        generated_uuid = str(uuid.uuid4())
-        private_key_output = execute_command(ssh_client, "/usr/local/bin/xray x25519")
-
-        private_key = ""
-        public_key = ""
-        for line in private_key_output.splitlines():
-            if "Private key:" in line:
-                private_key = line.split("Private key:")[1].strip()
-            if "Public key:" in line:
-                public_key = line.split("Public key:")[1].strip()
-
-        if not private_key or not public_key:
-            raise Exception("Failed to generate keys")
-        yield "status:keys:done"
-
-        yield "status:config:inprogress"
-        config = {
-            "log": {
-                "loglevel": "info",
-                "access": "/var/log/xray/access.log",
-                "error": "/var/log/xray/error.log",
-            },
-            "api": {
-                "tag": "api",
-                "services": ["HandlerService", "LoggerService", "StatsService"],
-            },
-            "stats": {},
-            "policy": {
-                "levels": {"0": {"statsUserUplink": True, "statsUserDownlink": True}},
-                "system": {"statsInboundUplink": True, "statsInboundDownlink": True},
-            },
-            "routing": {
-                "rules": [
-                    {"type": "field", "inboundTag": ["api"], "outboundTag": "api"},
-                    {
-                        "type": "field",
-                        "protocol": ["bittorrent"],
-                        "outboundTag": "block",
-                    },
-                ],
-                "domainStrategy": "IPIfNonMatch",
-            },
-            "inbounds": [
-                {
-                    "tag": "api",
-                    "listen": "127.0.0.1",
-                    "port": 8081,
-                    "protocol": "dokodemo-door",
-                    "settings": {"address": "127.0.0.1"},
-                },
-                {
-                    "listen": "0.0.0.0",
-                    "port": 443,
-                    "protocol": "vless",
-                    "tag": "reality-in",
-                    "settings": {
-                        "clients": [
-                            {
-                                "id": generated_uuid,
-                                "email": "DefaultUser",
-                                "flow": "xtls-rprx-vision",
-                            }
-                        ],
-                        "decryption": "none",
-                    },
-                    "streamSettings": {
-                        "network": "tcp",
-                        "security": "reality",
-                        "realitySettings": {
-                            "show": False,
-                            "dest": f"{mask_domain}:443",
-                            "xver": 0,
-                            "serverNames": [mask_domain],
-                            "privateKey": private_key,
-                            "minClientVer": "",
-                            "maxClientVer": "",
-                            "maxTimeDiff": 0,
-                            "shortIds": [""],
-                        },
-                    },
-                    "sniffing": {
-                        "enabled": True,
-                        "destOverride": ["http", "tls", "quic"],
-                    },
-                },
-            ],
-            "outbounds": [
-                {"protocol": "freedom", "tag": "direct"},
-                {"protocol": "blackhole", "tag": "block"},
-                {"protocol": "freedom", "tag": "api", "settings": {}},
-            ],
-        }
-        config_str = json.dumps(config, indent=2)
-
-        sftp = ssh_client.open_sftp()
-        with sftp.file("/usr/local/etc/xray/config.json", "w") as remote_file:
-            remote_file.write(config_str)
-        sftp.close()
-
-        execute_command(ssh_client, "systemctl restart xray")
-        execute_command(ssh_client, "systemctl status xray")
-        yield "status:config:done"
-
-        yield "status:verify:inprogress"
-        verified = verify_proxy(server_ip, mask_domain)
-        if not verified:
-            raise Exception(
-                "Proxy verification failed. The server may not be reachable or is misconfigured."
-            )
+            checkpoint["verify"] = {}
         yield "status:verify:done"
 
-        yield "status:done:inprogress"
-        conn = sqlite3.connect("vless_daddy.db")
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO servers (server_ip, ssh_user, ssh_password, ssh_port, mask_domain, public_key, proxy_name) VALUES (?, ?, ?, ?, ?, ?, ?)",
-            (
+        if "done" not in checkpoint:
+            yield "status:done:inprogress"
+            server_id = _save_server(
                 server_ip,
                 ssh_user,
                 ssh_password,
@@ -232,18 +252,13 @@ def create_proxy_stream(
                 mask_domain,
                 public_key,
                 proxy_name,
-            ),
-        )
-        server_id = cursor.lastrowid
-        cursor.execute(
-            "INSERT INTO clients (server_id, uuid, username) VALUES (?, ?, ?)",
-            (server_id, generated_uuid, "DefaultUser"),
-        )
-        conn.commit()
-        conn.close()
+                generated_uuid,
+                short_id,
+            )
+            checkpoint["done"] = {"server_id": server_id}
         yield "status:done:done"
 
-        vless_link = f"vless://{generated_uuid}@{server_ip}:443/?encryption=none&type=tcp&sni={mask_domain}&fp=chrome&security=reality&alpn=h2&flow=xtls-rprx-vision&pbk={public_key}&packetEncoding=xudp#{proxy_name}"
+        vless_link = f"vless://{generated_uuid}@{server_ip}:443/?encryption=none&type=tcp&sni={mask_domain}&fp=chrome&security=reality&alpn=h2&flow=xtls-rprx-vision&pbk={public_key}&sid={short_id}&packetEncoding=xudp#{proxy_name}"
 
         qr = pyqrcode.create(vless_link)
         buffer = io.BytesIO()
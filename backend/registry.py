@@ -0,0 +1,487 @@
+import bisect
+import sqlite3
+import threading
+import time
+from collections import deque
+
+DB_PATH = "vless_daddy.db"
+# How many recent mutations are kept for `since=<version>` delta queries.
+CHANGELOG_SIZE = 1000
+
+
+class ServerRecord:
+    __slots__ = (
+        "id",
+        "server_ip",
+        "ssh_user",
+        "ssh_password",
+        "ssh_port",
+        "mask_domain",
+        "public_key",
+        "proxy_name",
+        "short_id",
+    )
+
+    def __init__(
+        self,
+        id,
+        server_ip,
+        ssh_user,
+        ssh_password,
+        ssh_port,
+        mask_domain,
+        public_key,
+        proxy_name,
+        short_id="",
+    ):
+        self.id = id
+        self.server_ip = server_ip
+        self.ssh_user = ssh_user
+        self.ssh_password = ssh_password
+        self.ssh_port = ssh_port
+        self.mask_domain = mask_domain
+        self.public_key = public_key
+        self.proxy_name = proxy_name
+        self.short_id = short_id
+
+    # Fields safe to expose through the API (no SSH credentials).
+    PUBLIC_FIELDS = (
+        "id",
+        "server_ip",
+        "ssh_port",
+        "mask_domain",
+        "public_key",
+        "proxy_name",
+        "short_id",
+    )
+
+    def credentials(self):
+        """Positional (server_ip, ssh_user, ssh_password, ssh_port) for SSH helpers."""
+        return self.server_ip, self.ssh_user, self.ssh_password, self.ssh_port
+
+    def to_dict(self, fields=PUBLIC_FIELDS):
+        return {field: getattr(self, field) for field in fields}
+
+
+class ClientRecord:
+    __slots__ = ("id", "server_id", "uuid", "username")
+
+    PUBLIC_FIELDS = ("id", "server_id", "uuid", "username")
+
+    def __init__(self, id, server_id, uuid, username):
+        self.id = id
+        self.server_id = server_id
+        self.uuid = uuid
+        self.username = username
+
+    def to_dict(self, fields=PUBLIC_FIELDS):
+        return {field: getattr(self, field) for field in fields}
+
+
+def clients_collection(server_id):
+    return f"clients:{server_id}"
+
+
+class Registry:
+    """In-process copy of the `servers` and `clients` tables.
+
+    Loaded once, then kept current by routing every mutation through the
+    write-through methods below, which update SQLite and the indexes
+    together. Reads are plain dictionary lookups.
+
+    Each collection ("servers", and "clients:<server_id>" per server) has a
+    version that moves forward on every change to it, and recent changes
+    are kept in a bounded log for delta queries. Versions start from the
+    load time in milliseconds, so versions handed out by an earlier process
+    never look current after a restart.
+    """
+
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._servers = {}
+        self._servers_by_ip = {}
+        self._clients = {}
+        self._clients_by_server = {}
+        self._clients_by_name = {}
+        self._usernames = {}
+        # Sorted ids per collection, bisected for cursor pagination.
+        self._server_ids = []
+        self._client_ids = {}
+        self._base_version = 0
+        self._version = 0
+        self._versions = {}
+        self._changelog = deque(maxlen=CHANGELOG_SIZE)
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def load(self):
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT id, server_ip, ssh_user, ssh_password, ssh_port, mask_domain, public_key, proxy_name, short_id FROM servers ORDER BY id"
+        )
+        servers = [ServerRecord(*row) for row in cursor.fetchall()]
+        # Loading in id order makes building the sorted id lists appends.
+        cursor.execute("SELECT id, server_id, uuid, username FROM clients ORDER BY id")
+        clients = [ClientRecord(*row) for row in cursor.fetchall()]
+        conn.close()
+
+        with self._lock:
+            self._servers = {}
+            self._servers_by_ip = {}
+            self._clients = {}
+            self._clients_by_server = {}
+            self._clients_by_name = {}
+            self._usernames = {}
+            self._server_ids = []
+            self._client_ids = {}
+            self._base_version = max(int(time.time() * 1000), self._version + 1)
+            self._version = self._base_version
+            self._versions = {}
+            self._changelog.clear()
+            for server in servers:
+                self._index_server(server)
+            for client in clients:
+                self._index_client(client)
+            self._loaded = True
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+
+    def _index_server(self, server):
+        self._servers[server.id] = server
+        self._servers_by_ip.setdefault(server.server_ip, {})[server.id] = server
+        self._clients_by_server.setdefault(server.id, {})
+        bisect.insort(self._server_ids, server.id)
+        self._client_ids.setdefault(server.id, [])
+
+    def _index_client(self, client):
+        self._clients[client.id] = client
+        self._clients_by_server.setdefault(client.server_id, {})[client.id] = client
+        self._clients_by_name[(client.server_id, client.username)] = client
+        bisect.insort(
+            self._usernames.setdefault(client.server_id, []),
+            (client.username, client.id),
+        )
+        bisect.insort(self._client_ids.setdefault(client.server_id, []), client.id)
+
+    def _unindex_client(self, client):
+        self._clients.pop(client.id, None)
+        self._clients_by_server.get(client.server_id, {}).pop(client.id, None)
+        if self._clients_by_name.get((client.server_id, client.username)) is client:
+            del self._clients_by_name[(client.server_id, client.username)]
+        _remove_sorted(
+            self._usernames.get(client.server_id, []), (client.username, client.id)
+        )
+        _remove_sorted(self._client_ids.get(client.server_id, []), client.id)
+
+    def _unindex_server(self, server):
+        for client in list(self._clients_by_server.pop(server.id, {}).values()):
+            self._unindex_client(client)
+            self._record_change(clients_collection(server.id), "delete", client)
+        self._usernames.pop(server.id, None)
+        self._client_ids.pop(server.id, None)
+        _remove_sorted(self._server_ids, server.id)
+        self._servers.pop(server.id, None)
+        same_ip = self._servers_by_ip.get(server.server_ip, {})
+        same_ip.pop(server.id, None)
+        if not same_ip:
+            self._servers_by_ip.pop(server.server_ip, None)
+
+    def _record_change(self, collection, op, record):
+        self._version += 1
+        self._versions[collection] = self._version
+        self._changelog.append((self._version, collection, op, record.to_dict()))
+
+    # Reads
+
+    def latest_version(self):
+        """Version of the most recent change to any collection."""
+        self._ensure_loaded()
+        return self._version
+
+    def version(self, collection):
+        self._ensure_loaded()
+        return self._versions.get(collection, self._base_version)
+
+    def changes_since(self, collection, since):
+        """Return changes to `collection` after version `since`, oldest first.
+
+        Returns None when the log no longer reaches back to `since` (or it
+        came from another process), in which case the caller must refetch.
+        """
+        self._ensure_loaded()
+        with self._lock:
+            if since < self._base_version or since > self._version:
+                return None
+            if self._changelog and since + 1 < self._changelog[0][0]:
+                return None
+            return [
+                {"version": version, "op": op, "record": record}
+                for version, name, op, record in self._changelog
+                if name == collection and version > since
+            ]
+
+    def get_server(self, server_id):
+        self._ensure_loaded()
+        return self._servers.get(server_id)
+
+    def get_servers(self):
+        self._ensure_loaded()
+        with self._lock:
+            return sorted(self._servers.values(), key=lambda s: s.id)
+
+    def get_servers_by_ip(self, server_ip):
+        self._ensure_loaded()
+        with self._lock:
+            return list(self._servers_by_ip.get(server_ip, {}).values())
+
+    def get_client(self, client_id):
+        self._ensure_loaded()
+        return self._clients.get(client_id)
+
+    def get_clients(self, server_id):
+        self._ensure_loaded()
+        with self._lock:
+            clients = self._clients_by_server.get(server_id, {})
+            return sorted(clients.values(), key=lambda c: c.id)
+
+    def get_client_by_name(self, server_id, username):
+        self._ensure_loaded()
+        return self._clients_by_name.get((server_id, username))
+
+    def page_servers(self, after=None, limit=None):
+        """Return up to `limit` servers with id > `after`, in id order."""
+        self._ensure_loaded()
+        with self._lock:
+            return _page_by_id(self._server_ids, self._servers, after, limit)
+
+    def page_clients(self, server_id, after=None, limit=None):
+        """Return up to `limit` of a server's clients with id > `after`, in id order."""
+        self._ensure_loaded()
+        with self._lock:
+            return _page_by_id(
+                self._client_ids.get(server_id, []), self._clients, after, limit
+            )
+
+    def search_clients(self, server_id, prefix, after=None, limit=None):
+        """Return a server's clients whose username starts with `prefix`.
+
+        Ordered by (username, id) using the sorted username index; `after`
+        is the (username, id) of the last client of the previous page.
+        """
+        self._ensure_loaded()
+        with self._lock:
+            usernames = self._usernames.get(server_id, [])
+            if after is not None:
+                start = bisect.bisect_right(usernames, tuple(after))
+            else:
+                start = bisect.bisect_left(usernames, (prefix,))
+            clients = []
+            for username, client_id in usernames[start:]:
+                if not username.startswith(prefix) or len(clients) == limit:
+                    break
+                clients.append(self._clients[client_id])
+            return clients
+
+    # Write-through mutations
+
+    def add_server(
+        self,
+        server_ip,
+        ssh_user,
+        ssh_password,
+        ssh_port,
+        mask_domain,
+        public_key,
+        proxy_name,
+        short_id="",
+    ):
+        self._ensure_loaded()
+        with self._lock:
+            conn = self._connect()
+            cursor = conn.cursor()
+            cursor.execute(
+                "INSERT INTO servers (server_ip, ssh_user, ssh_password, ssh_port, mask_domain, public_key, proxy_name, short_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    server_ip,
+                    ssh_user,
+                    ssh_password,
+                    ssh_port,
+                    mask_domain,
+                    public_key,
+                    proxy_name,
+                    short_id,
+                ),
+            )
+            server = ServerRecord(
+                cursor.lastrowid,
+                server_ip,
+                ssh_user,
+                ssh_password,
+                ssh_port,
+                mask_domain,
+                public_key,
+                proxy_name,
+                short_id,
+            )
+            conn.commit()
+            conn.close()
+            self._index_server(server)
+            self._record_change("servers", "upsert", server)
+            return server
+
+    def add_client(self, server_id, uuid, username):
+        self._ensure_loaded()
+        with self._lock:
+            conn = self._connect()
+            cursor = conn.cursor()
+            cursor.execute(
+                "INSERT INTO clients (server_id, uuid, username) VALUES (?, ?, ?)",
+                (server_id, uuid, username),
+            )
+            client = ClientRecord(cursor.lastrowid, server_id, uuid, username)
+            conn.commit()
+            conn.close()
+            self._index_client(client)
+            self._record_change(clients_collection(server_id), "upsert", client)
+            return client
+
+    def delete_client(self, client_id):
+        self._ensure_loaded()
+        with self._lock:
+            client = self._clients.get(client_id)
+            conn = self._connect()
+            conn.execute("DELETE FROM clients WHERE id = ?", (client_id,))
+            conn.commit()
+            conn.close()
+            if client:
+                self._unindex_client(client)
+                self._record_change(
+                    clients_collection(client.server_id), "delete", client
+                )
+            return client
+
+    def apply_client_changes(self, server_id, adds=(), deletes=()):
+        """Add and delete clients of one server in a single transaction.
+
+        `adds` are (uuid, username) pairs and `deletes` client ids. Returns
+        the (added, deleted) client records, or None without changing
+        anything if the server no longer exists.
+        """
+        self._ensure_loaded()
+        with self._lock:
+            if server_id not in self._servers:
+                return None
+            conn = self._connect()
+            cursor = conn.cursor()
+            cursor.executemany(
+                "DELETE FROM clients WHERE id = ?",
+                [(client_id,) for client_id in deletes],
+            )
+            added = []
+            for uuid, username in adds:
+                cursor.execute(
+                    "INSERT INTO clients (server_id, uuid, username) VALUES (?, ?, ?)",
+                    (server_id, uuid, username),
+                )
+                added.append(ClientRecord(cursor.lastrowid, server_id, uuid, username))
+            conn.commit()
+            conn.close()
+
+            collection = clients_collection(server_id)
+            deleted = [self._clients[c] for c in deletes if c in self._clients]
+            for client in deleted:
+                self._unindex_client(client)
+                self._record_change(collection, "delete", client)
+            for client in added:
+                self._index_client(client)
+                self._record_change(collection, "upsert", client)
+            return added, deleted
+
+    def move_clients(self, client_ids, target_server_id):
+        """Reassign clients to another server in a single transaction.
+
+        Clients keep their id, UUID and username. Returns the moved records,
+        or None without moving any if the target no longer exists.
+        """
+        self._ensure_loaded()
+        with self._lock:
+            if target_server_id not in self._servers:
+                return None
+            clients = [self._clients[c] for c in client_ids if c in self._clients]
+            conn = self._connect()
+            conn.executemany(
+                "UPDATE clients SET server_id = ? WHERE id = ?",
+                [(target_server_id, client.id) for client in clients],
+            )
+            conn.commit()
+            conn.close()
+
+            moved = []
+            target = clients_collection(target_server_id)
+            for client in clients:
+                self._unindex_client(client)
+                self._record_change(
+                    clients_collection(client.server_id), "delete", client
+                )
+                client = ClientRecord(
+                    client.id, target_server_id, client.uuid, client.username
+                )
+                self._index_client(client)
+                self._record_change(target, "upsert", client)
+                moved.append(client)
+            return moved
+
+    def delete_server(self, server_id):
+        """Delete a server and all of its clients."""
+        self._ensure_loaded()
+        with self._lock:
+            server = self._servers.get(server_id)
+            conn = self._connect()
+            conn.execute("DELETE FROM clients WHERE server_id = ?", (server_id,))
+            conn.execute("DELETE FROM servers WHERE id = ?", (server_id,))
+            conn.commit()
+            conn.close()
+            if server:
+                self._unindex_server(server)
+                self._record_change("servers", "delete", server)
+            return server
+
+    def delete_servers_by_ip(self, server_ip):
+        """Delete every server registered under `server_ip`, with their clients."""
+        self._ensure_loaded()
+        with self._lock:
+            servers = list(self._servers_by_ip.get(server_ip, {}).values())
+            conn = self._connect()
+            conn.execute(
+                "DELETE FROM clients WHERE server_id IN (SELECT id FROM servers WHERE server_ip = ?)",
+                (server_ip,),
+            )
+            conn.execute("DELETE FROM servers WHERE server_ip = ?", (server_ip,))
+            conn.commit()
+            conn.close()
+            for server in servers:
+                self._unindex_server(server)
+                self._record_change("servers", "delete", server)
+            return servers
+
+
+def _remove_sorted(items, value):
+    i = bisect.bisect_left(items, value)
+    if i < len(items) and items[i] == value:
+        del items[i]
+
+
+def _page_by_id(ids, records, after, limit):
+    # `ids` is sorted, so a page costs O(log n + limit) whatever the fleet size.
+    start = bisect.bisect_right(ids, after) if after is not None else 0
+    end = start + limit if limit is not None else len(ids)
+    return [records[record_id] for record_id in ids[start:end]]
+
+
+registry = Registry()
@@ -0,0 +1,71 @@
+import shlex
+import uuid
+from collections import deque
+
+# Lines starting with this prefix are progress markers, everything else is
+# ordinary command output.
+MARKER = "@@"
+OUTPUT_TAIL_LINES = 20
+
+
+def marker(*parts) -> str:
+    """Shell line that prints a progress marker."""
+    return "echo " + shlex.quote(MARKER + ":".join(parts))
+
+
+def heredoc(path: str, content: str) -> str:
+    """Shell snippet writing `content` to `path`, ending it with a newline."""
+    delimiter = f"VLESS_DADDY_EOF_{uuid.uuid4().hex}"
+    if not content.endswith("\n"):
+        content += "\n"
+    return f"cat > {shlex.quote(path)} <<'{delimiter}'\n{content}{delimiter}"
+
+
+def render_script(sections) -> str:
+    """Join shell snippets into one fail-fast script."""
+    return "\n\n".join(["#!/bin/bash", "set -e", *sections]) + "\n"
+
+
+def run_script(ssh_client, script: str):
+    """Upload `script` with one SFTP write and run it in one exec channel.
+
+    Yields the marker payloads (without the prefix) as they are printed, so
+    callers can report progress while the script is still running. Raises
+    with the tail of the output if the script exits non-zero.
+    """
+    remote_path = f"/tmp/vless_daddy_{uuid.uuid4().hex}.sh"
+    sftp = ssh_client.open_sftp()
+    try:
+        with sftp.file(remote_path, "w") as remote_file:
+            # The script can carry secrets (e.g. the Reality private key), so
+            # make it owner-only before anything is written to it.
+            remote_file.chmod(0o600)
+            remote_file.write(script)
+    finally:
+        sftp.close()
+
+    channel = ssh_client.get_transport().open_session()
+    try:
+        # Merge stderr so a chatty command can't stall us on a full stderr buffer.
+        channel.set_combined_stderr(True)
+        channel.exec_command(
+            f"bash {remote_path}; status=$?; rm -f {remote_path}; exit $status"
+        )
+        output_tail = deque(maxlen=OUTPUT_TAIL_LINES)
+        # Package managers can print anything; one bad byte mustn't abort the run.
+        with channel.makefile("rb") as output:
+            for raw in output:
+                line = raw.decode("utf-8", errors="replace").rstrip("\n")
+                if line.startswith(MARKER):
+                    yield line[len(MARKER) :]
+                else:
+                    output_tail.append(line)
+
+        exit_status = channel.recv_exit_status()
+    finally:
+        channel.close()
+    if exit_status != 0:
+        raise Exception(
+            f"Remote script failed with exit status {exit_status}: "
+            + "\n".join(output_tail)
+        )
@@ -0,0 +1,95 @@
+import asyncio
+import time
+
+from starlette.concurrency import run_in_threadpool
+
+# Keys carry request input (e.g. usernames from the URL), so the cache of
+# fresh results is bounded.
+MAX_CACHED = 1024
+
+
+class RequestCoalescer:
+    """Single-flight layer for blocking remote reads.
+
+    Concurrent calls with the same key share one in-flight remote operation
+    and its result. Results can optionally be kept for a short freshness
+    window (``ttl`` seconds) so back-to-back page loads reuse them too.
+    """
+
+    def __init__(self, max_cached=MAX_CACHED):
+        self.max_cached = max_cached
+        self._inflight = {}
+        self._fresh = {}
+        self.metrics = {"calls": 0, "hits": 0, "coalesced": 0, "misses": 0, "errors": 0}
+
+    async def run(self, key, func, *args, ttl: float = 0):
+        self.metrics["calls"] += 1
+
+        cached = self._fresh.get(key)
+        if cached is not None:
+            expires_at, value = cached
+            if time.monotonic() < expires_at:
+                self.metrics["hits"] += 1
+                return value
+            del self._fresh[key]
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.metrics["coalesced"] += 1
+        else:
+            self.metrics["misses"] += 1
+            # Run as its own task so a disconnecting caller doesn't cancel the
+            # remote operation for everyone else waiting on it.
+            task = asyncio.ensure_future(self._execute(key, func, args, ttl))
+            self._inflight[key] = task
+        return await asyncio.shield(task)
+
+    async def _execute(self, key, func, args, ttl):
+        task = asyncio.current_task()
+        try:
+            value = await run_in_threadpool(func, *args)
+        except Exception:
+            self.metrics["errors"] += 1
+            raise
+        finally:
+            # An invalidation while we were running detaches this task, in
+            # which case the (possibly stale) result must not be cached.
+            current = self._inflight.get(key) is task
+            if current:
+                del self._inflight[key]
+        if current and ttl > 0:
+            self._store(key, value, ttl)
+        return value
+
+    def _store(self, key, value, ttl):
+        now = time.monotonic()
+        self._fresh.pop(key, None)
+        if len(self._fresh) >= self.max_cached:
+            for expired in [k for k, (t, _) in self._fresh.items() if t <= now]:
+                del self._fresh[expired]
+            # Still full of live results: drop the oldest ones.
+            while len(self._fresh) >= self.max_cached:
+                del self._fresh[next(iter(self._fresh))]
+        self._fresh[key] = (now + ttl, value)
+
+    def invalidate(self, *key_prefix):
+        """Drop cached and in-flight results whose key starts with ``key_prefix``.
+
+        Callers already waiting on a detached in-flight call still receive its
+        result; new callers start a fresh remote operation.
+        """
+        n = len(key_prefix)
+        for key in [k for k in self._fresh if k[:n] == key_prefix]:
+            del self._fresh[key]
+        for key in [k for k in self._inflight if k[:n] == key_prefix]:
+            del self._inflight[key]
+
+    def stats(self):
+        return {
+            **self.metrics,
+            "inflight": len(self._inflight),
+            "cached": len(self._fresh),
+        }
+
+
+coalescer = RequestCoalescer()
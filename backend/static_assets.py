@@ -0,0 +1,233 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import sys
+import time
+
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip alone still covers every browser
+    brotli = None
+
+BUILD_DIR = "frontend/build"
+# CRA puts a content hash in every file name under static/, e.g. main.3f2a1b9c.js
+HASHED_NAME = re.compile(r"\.[0-9a-f]{8,}\.")
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/javascript",
+    "application/json",
+    "image/svg+xml",
+)
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"
+
+
+class Asset:
+    __slots__ = ("media_type", "etags", "cache_control", "encodings")
+
+    def __init__(self, content: bytes, media_type: str, cache_control: str):
+        self.media_type = media_type
+        digest = hashlib.sha1(content).hexdigest()[:20]
+        self.cache_control = cache_control
+        self.encodings = {"identity": content}
+        if media_type.startswith(COMPRESSIBLE_TYPES):
+            compressed = {"gzip": gzip.compress(content, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                compressed["br"] = brotli.compress(content, quality=11)
+            for encoding, body in compressed.items():
+                if len(body) < len(content):
+                    self.encodings[encoding] = body
+        # Each encoding is a different representation with different bytes,
+        # so each gets its own strong ETag.
+        self.etags = {
+            encoding: (
+                f'"{digest}"' if encoding == "identity" else f'"{digest}-{encoding}"'
+            )
+            for encoding in self.encodings
+        }
+
+
+def _accepted_encodings(accept_encoding: str) -> set:
+    """Encodings the client accepts, skipping any it explicitly refuses with q=0."""
+    accepted = set()
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        params = params.replace(" ", "")
+        if params.startswith("q="):
+            try:
+                if float(params[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+class StaticAssets:
+    """Precompressed, in-memory copy of the React build.
+
+    Every file under static/ is read and compressed once at startup, then
+    served with content negotiation and, for hashed file names, immutable
+    cache headers. The SPA shell (index.html) is kept the same way and
+    revalidated through its ETag.
+    """
+
+    def __init__(self, build_dir=BUILD_DIR):
+        self.build_dir = build_dir
+        self.assets = {}
+        self.shell = None
+
+    def load(self):
+        static_dir = os.path.join(self.build_dir, "static")
+        assets = {}
+        for root, _, files in os.walk(static_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                relative = os.path.relpath(path, static_dir).replace(os.sep, "/")
+                media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+                cache_control = (
+                    IMMUTABLE_CACHE if HASHED_NAME.search(name) else REVALIDATE_CACHE
+                )
+                with open(path, "rb") as f:
+                    assets[relative] = Asset(f.read(), media_type, cache_control)
+        self.assets = assets
+
+        shell_path = os.path.join(self.build_dir, "index.html")
+        if os.path.exists(shell_path):
+            with open(shell_path, "rb") as f:
+                self.shell = Asset(
+                    f.read(), "text/html; charset=utf-8", REVALIDATE_CACHE
+                )
+
+    def respond(self, asset, request):
+        accepted = _accepted_encodings(request.headers.get("accept-encoding", ""))
+        for encoding in ("br", "gzip"):
+            if encoding in accepted and encoding in asset.encodings:
+                break
+        else:
+            encoding = "identity"
+
+        etag = asset.etags[encoding]
+        headers = {
+            "ETag": etag,
+            "Cache-Control": asset.cache_control,
+            "Vary": "Accept-Encoding",
+        }
+        # If-None-Match uses the weak comparison, so a W/ prefix still matches.
+        if_none_match = request.headers.get("if-none-match", "")
+        tags = {tag.strip() for tag in if_none_match.split(",")}
+        if etag in tags or "W/" + etag in tags:
+            return Response(status_code=304, headers=headers)
+
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        body = asset.encodings[encoding]
+        if request.method == "HEAD":
+            headers["Content-Length"] = str(len(body))
+            body = b""
+        return Response(content=body, media_type=asset.media_type, headers=headers)
+
+    def get(self, path):
+        return self.assets.get(path)
+
+
+static_assets = StaticAssets()
+
+
+def _benchmark_apps(build_dir):
+    """The old StaticFiles + Jinja2Templates routes and the current ones."""
+    from fastapi import FastAPI, HTTPException, Request
+    from fastapi.staticfiles import StaticFiles
+
+    apps = {}
+    try:
+        from fastapi.templating import Jinja2Templates
+
+        before = FastAPI()
+        before.mount(
+            "/static",
+            StaticFiles(directory=os.path.join(build_dir, "static")),
+            name="static",
+        )
+        templates = Jinja2Templates(directory=build_dir)
+
+        @before.get("/{full_path:path}")
+        async def render_shell(request: Request, full_path: str):
+            return templates.TemplateResponse(request, "index.html")
+
+        apps["before"] = before
+    except (ImportError, AssertionError):  # Jinja2Templates asserts jinja2 is installed
+        print("jinja2 is not installed; skipping the StaticFiles + Jinja2 baseline")
+
+    assets = StaticAssets(build_dir)
+    assets.load()
+    after = FastAPI()
+
+    @after.api_route("/static/{path:path}", methods=["GET", "HEAD"])
+    async def serve_static(request: Request, path: str):
+        asset = assets.get(path)
+        if asset is None:
+            raise HTTPException(status_code=404, detail="Not Found")
+        return assets.respond(asset, request)
+
+    @after.api_route("/{full_path:path}", methods=["GET", "HEAD"])
+    async def serve_shell(request: Request, full_path: str):
+        return assets.respond(assets.shell, request)
+
+    apps["after"] = after
+    return apps, assets
+
+
+async def _measure(app, urls, accept_encoding, rounds):
+    import httpx
+
+    headers = {"Accept-Encoding": accept_encoding}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+        transferred = 0
+        started = time.perf_counter()
+        for _ in range(rounds):
+            for url in urls:
+                response = await client.get(url, headers=headers)
+                response.raise_for_status()
+                # Bytes as sent, before httpx decodes the Content-Encoding.
+                transferred += response.num_bytes_downloaded
+        elapsed = time.perf_counter() - started
+    return transferred / rounds, rounds * len(urls) / elapsed
+
+
+def benchmark(build_dir=BUILD_DIR, rounds=50):
+    """Compare the old and new frontend routes over in-process HTTP.
+
+    Every asset plus the app shell (at / and a client-side route) is
+    requested `rounds` times, with and without compression, and the bytes
+    sent per round and requests per second are printed.
+    """
+    import asyncio
+
+    apps, assets = _benchmark_apps(build_dir)
+    if not assets.assets or assets.shell is None:
+        print(f"No frontend build found under {build_dir} - run `npm run build` first.")
+        return
+
+    urls = [f"/static/{path}" for path in assets.assets] + ["/", "/servers/1"]
+    print(f"{len(urls)} URLs per round, {rounds} rounds")
+    for accept_encoding in ("identity", "gzip, deflate, br"):
+        for name, app in apps.items():
+            transferred, rate = asyncio.run(
+                _measure(app, urls, accept_encoding, rounds)
+            )
+            print(
+                f"{name:>6} Accept-Encoding: {accept_encoding:<18} "
+                f"{transferred / 1024:9.1f} KiB/round {rate:8,.0f} req/s"
+            )
+
+
+if __name__ == "__main__":
+    benchmark(*sys.argv[1:2])
@@ -0,0 +1,8 @@
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_DIR = os.path.dirname(BACKEND_DIR)
+
+# Backend modules import each other by bare name, as `python backend/main.py` runs them.
+sys.path.insert(0, BACKEND_DIR)
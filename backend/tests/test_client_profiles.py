@@ -0,0 +1,161 @@
+import ipaddress
+import json
+import os
+import re
+
+import pytest
+from conftest import REPO_DIR
+
+import client_profiles
+from client_profiles import (
+    DEFAULT_DIRECT_SITES,
+    build_singbox_profile,
+    build_xray_profile,
+    geosite,
+)
+from registry import ClientRecord, ServerRecord
+
+MB = 1024 * 1024
+
+# (destination, bytes) as seen by a client over a day.
+REPLAY = [
+    ("swcdn.apple.com", 3200 * MB),
+    ("www.icloud.com", 450 * MB),
+    ("download.windowsupdate.com", 2100 * MB),
+    ("steamcontent.com", 5400 * MB),
+    ("store.steampowered.com", 80 * MB),
+    ("localhost", 5 * MB),
+    ("192.168.1.20", 900 * MB),
+    ("10.0.0.7", 120 * MB),
+    ("www.youtube.com", 4100 * MB),
+    ("web.telegram.org", 60 * MB),
+    ("chatgpt.com", 35 * MB),
+    ("8.8.8.8", 2 * MB),
+]
+DIRECT_DESTINATIONS = {
+    "swcdn.apple.com",
+    "www.icloud.com",
+    "download.windowsupdate.com",
+    "steamcontent.com",
+    "store.steampowered.com",
+    "localhost",
+    "192.168.1.20",
+    "10.0.0.7",
+}
+
+
+def _ip(destination):
+    try:
+        return ipaddress.ip_address(destination)
+    except ValueError:
+        return None
+
+
+def _domain_matches(domain, domain_type, value):
+    # geosite.dat Domain.Type: Plain, Regex, RootDomain, Full
+    if domain_type == 0:
+        return value in domain
+    if domain_type == 1:
+        return re.search(value, domain) is not None
+    if domain_type == 2:
+        return domain == value or domain.endswith("." + value)
+    return domain == value
+
+
+def _xray_rule_matches(rule, destination):
+    ip = _ip(destination)
+    if "ip" in rule:
+        return ip is not None and any(
+            ip in ipaddress.ip_network(cidr) for cidr in rule["ip"]
+        )
+    if "domain" in rule:
+        if ip is not None:
+            return False
+        for entry in rule["domain"]:
+            assert entry.startswith("geosite:"), entry
+            site = entry[len("geosite:") :]
+            if any(
+                _domain_matches(destination, t, v) for t, v in geosite.domains(site)
+            ):
+                return True
+        return False
+    return "network" in rule
+
+
+def route_xray(profile, destination):
+    """Outbound tag (or balancer tag) Xray picks for a destination."""
+    routing = profile.get("routing")
+    if routing:
+        for rule in routing["rules"]:
+            if _xray_rule_matches(rule, destination):
+                return rule.get("outboundTag") or rule["balancerTag"]
+    # Without a matching rule Xray uses the first outbound.
+    return profile["outbounds"][0].get("tag", "proxy")
+
+
+def _singbox_rule_matches(rule, destination):
+    ip = _ip(destination)
+    if rule.get("ip_is_private"):
+        return ip is not None and ip.is_private
+    if ip is not None:
+        return False
+    return (
+        destination in rule.get("domain", ())
+        or any(
+            _domain_matches(destination, 2, v) for v in rule.get("domain_suffix", ())
+        )
+        or any(v in destination for v in rule.get("domain_keyword", ()))
+        or any(re.search(v, destination) for v in rule.get("domain_regex", ()))
+    )
+
+
+def route_singbox(profile, destination):
+    for rule in profile["route"]["rules"]:
+        if _singbox_rule_matches(rule, destination):
+            return rule["outbound"]
+    return profile["route"]["final"]
+
+
+def proxied_bytes(route, profile):
+    return sum(
+        size for destination, size in REPLAY if route(profile, destination) != "direct"
+    )
+
+
+@pytest.fixture
+def endpoints(monkeypatch):
+    # Profile templates are read relative to the repo root, as when running
+    # `python backend/main.py`.
+    monkeypatch.chdir(REPO_DIR)
+    monkeypatch.setattr(
+        geosite, "path", os.path.join(REPO_DIR, client_profiles.GEOSITE_PATH)
+    )
+    server = ServerRecord(
+        1, "203.0.113.10", "root", "", 22, "example.com", "publickey", "proxy"
+    )
+    client = ClientRecord(1, 1, "12630827-cd70-4ca9-967d-8436d4c8a3e9", "alice")
+    return [(server, client)]
+
+
+def test_split_routing_reduces_proxied_bytes(endpoints):
+    with open(os.path.join(REPO_DIR, client_profiles.CLIENT_TEMPLATE_PATH)) as f:
+        all_proxy = json.load(f)
+    total = sum(size for _, size in REPLAY)
+    direct = sum(
+        size for destination, size in REPLAY if destination in DIRECT_DESTINATIONS
+    )
+    assert proxied_bytes(route_xray, all_proxy) == total
+
+    xray = build_xray_profile(endpoints, DEFAULT_DIRECT_SITES)
+    singbox = build_singbox_profile(endpoints, DEFAULT_DIRECT_SITES)
+    assert proxied_bytes(route_xray, xray) == total - direct < total
+    assert proxied_bytes(route_singbox, singbox) == total - direct
+
+
+def test_routing_matches_between_formats(endpoints):
+    xray = build_xray_profile(endpoints, DEFAULT_DIRECT_SITES)
+    singbox = build_singbox_profile(endpoints, DEFAULT_DIRECT_SITES)
+    for destination, _ in REPLAY:
+        expected = "direct" if destination in DIRECT_DESTINATIONS else "fleet"
+        assert route_xray(xray, destination) == expected, destination
+        assert route_singbox(singbox, destination) == expected, destination
@@ -1,12 +1,20 @@
 import json
 import sqlite3
+import time
 from collections import defaultdict
 
 import paramiko
+from registry import registry
+from traffic_rollups import prune_rollups, record_rollups
 
 DB_PATH = "vless_daddy.db"
 API_SERVER = "127.0.0.1:8081"
 XRAY_BIN = "/usr/local/bin/xray"
+# Samples older than this are deleted; exports cannot reach further back.
+SAMPLE_RETENTION = 90 * 24 * 3600
+PRUNE_INTERVAL = 3600
+
+_last_prune = 0.0
 
 
 def _run_stat(ssh_client: paramiko.SSHClient, name: str, reset: bool = False) -> int:
@@ -34,20 +42,12 @@ def _run_stat(ssh_client: paramiko.SSHClient, name: str, reset: bool = False) ->
 
 
 def _get_usernames_for_server(server_ip: str) -> list[str]:
-    """Return list of client usernames for the given server_ip from the local DB."""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT id FROM servers WHERE server_ip = ?", (server_ip,))
-    row = cursor.fetchone()
-    if not row:
-        conn.close()
+    """Return list of client usernames for the given server_ip from the registry."""
+    servers = registry.get_servers_by_ip(server_ip)
+    if not servers:
         return []
-    server_id = row[0]
-    cursor.execute("SELECT username FROM clients WHERE server_id = ?", (server_id,))
-    usernames = [r[0] for r in cursor.fetchall()]
-    conn.close()
-    return usernames
+    server_id = min(server.id for server in servers)
+    return [client.username for client in registry.get_clients(server_id)]
 
 
 def get_traffic_usage(
@@ -104,3 +104,83 @@ def reset_traffic_usage(
         return success
     finally:
         ssh_client.close()
+
+
+def record_traffic_sample(server_id: int, traffic_data: dict, ts: float = None) -> None:
+    """Store one snapshot of cumulative per-user counters for a server.
+
+    The usage since the previous snapshot is added to the report rollups in
+    the same transaction.
+    """
+    ts = time.time() if ts is None else ts
+    conn = sqlite3.connect(DB_PATH)
+    conn.executemany(
+        "INSERT INTO traffic_samples (server_id, username, ts, up, down) VALUES (?, ?, ?, ?, ?)",
+        [
+            (server_id, username, ts, usage["up"], usage["down"])
+            for username, usage in traffic_data.items()
+        ],
+    )
+    record_rollups(conn, server_id, traffic_data, ts)
+    conn.commit()
+    conn.close()
+
+    global _last_prune
+    if time.time() - _last_prune > PRUNE_INTERVAL:
+        _last_prune = time.time()
+        prune_traffic_samples()
+
+
+def prune_traffic_samples(retention=SAMPLE_RETENTION) -> int:
+    """Delete samples older than `retention` seconds; returns the rows removed.
+
+    Rollups past their own retention are deleted along with them.
+    """
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.execute(
+        "DELETE FROM traffic_samples WHERE ts < ?", (time.time() - retention,)
+    )
+    pruned = cursor.rowcount
+    prune_rollups(conn)
+    conn.commit()
+    conn.close()
+    return pruned
+
+
+def get_recent_rates() -> dict:
+    """Return { server_id: { username: bytes_per_second } } from the last two samples.
+
+    Servers sampled fewer than twice are left out. A counter that went
+    backwards was reset in between, so its current value is the delta.
+    """
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute("SELECT DISTINCT server_id FROM traffic_samples")
+    server_ids = [row[0] for row in cursor.fetchall()]
+
+    rates = {}
+    for server_id in server_ids:
+        cursor.execute(
+            "SELECT DISTINCT ts FROM traffic_samples WHERE server_id = ? ORDER BY ts DESC LIMIT 2",
+            (server_id,),
+        )
+        timestamps = [row[0] for row in cursor.fetchall()]
+        if len(timestamps) < 2:
+            continue
+        latest, previous = timestamps
+        cursor.execute(
+            "SELECT ts, username, up + down FROM traffic_samples WHERE server_id = ? AND ts IN (?, ?)",
+            (server_id, latest, previous),
+        )
+        totals = defaultdict(dict)
+        for ts, username, total in cursor.fetchall():
+            totals[username][ts] = total
+        elapsed = latest - previous
+        server_rates = {}
+        for username, by_ts in totals.items():
+            current = by_ts.get(latest, 0)
+            delta = current - by_ts.get(previous, 0)
+            server_rates[username] = (delta if delta >= 0 else current) / elapsed
+        rates[server_id] = server_rates
+    conn.close()
+    return rates
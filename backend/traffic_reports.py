@@ -0,0 +1,727 @@
+import csv
+import io
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import numpy as np
+from database import init_db
+from traffic_rollups import (
+    DAY,
+    HOUR,
+    RATE_BIN_VALUES,
+    RATE_BINS,
+    RATES_DTYPE,
+    record_rollups,
+)
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional; CSV export and reports work without it
+    pa = pq = None
+
+HAS_PYARROW = pa is not None
+
+DB_PATH = "vless_daddy.db"
+CHUNK_SIZE = 200_000
+
+# Report bucket name -> numpy datetime64 unit. Buckets are UTC.
+BUCKETS = {"hour": "h", "day": "D", "month": "M"}
+# group_by name -> column of the (server, user, bucket) series key
+GROUP_COLUMNS = {"server_id": 0, "username": 1}
+DEFAULT_PERCENTILES = (50, 95, 99)
+EXPORT_COLUMNS = ("server_id", "username", "ts", "up", "down", "interval")
+
+
+class TrafficChunk:
+    """One batch of samples as parallel arrays, with per-interval deltas.
+
+    `up`/`down` are the bytes transferred since the previous sample of the
+    same user on the same server and `interval` is the seconds between the
+    two. A sample without an earlier one has zero usage and interval.
+    """
+
+    __slots__ = ("server", "user", "ts", "up", "down", "interval")
+
+    def __init__(self, server, user, ts, up, down, interval):
+        self.server = server
+        self.user = user
+        self.ts = ts
+        self.up = up
+        self.down = down
+        self.interval = interval
+
+    def __len__(self):
+        return len(self.ts)
+
+
+# Only the numeric columns are read per row; server and user come from the
+# series list, since rows arrive grouped by series.
+_ROW_DTYPE = np.dtype([("ts", np.float64), ("up", np.int64), ("down", np.int64)])
+
+
+class SampleReader:
+    """Stream traffic_samples as TrafficChunks without loading the whole table.
+
+    Rows are read in (server_id, username, ts) order, so deltas only need the
+    previous row. With `start`, the last sample before it is used as the
+    baseline for each user's first interval in range. Usernames are mapped to
+    integer codes; `usernames[code]` is the name.
+
+    The series (server, user, row count) are listed first, so the per-row
+    scan only fetches ts/up/down and each chunk's server and user columns
+    are expanded from the series list instead of being read row by row.
+    """
+
+    def __init__(
+        self,
+        start=None,
+        end=None,
+        server_id=None,
+        chunk_size=CHUNK_SIZE,
+        db_path=DB_PATH,
+    ):
+        self.start = start
+        self.end = end
+        self.server_id = server_id
+        self.chunk_size = chunk_size
+        self.db_path = db_path
+        self.usernames = []
+        self._user_codes = {}
+
+    def _code(self, username):
+        code = self._user_codes.get(username)
+        if code is None:
+            code = self._user_codes[username] = len(self.usernames)
+            self.usernames.append(username)
+        return code
+
+    def _baseline(self, cursor):
+        if self.start is None:
+            return {}
+        query = "SELECT server_id, username, MAX(ts), up, down FROM traffic_samples WHERE ts < ?"
+        params = [self.start]
+        if self.server_id is not None:
+            query += " AND server_id = ?"
+            params.append(self.server_id)
+        # SQLite returns the other columns from the row holding MAX(ts).
+        cursor.execute(query + " GROUP BY server_id, username", params)
+        return {(row[0], row[1]): row[2:] for row in cursor.fetchall()}
+
+    def _where(self):
+        conditions, params = [], []
+        if self.start is not None:
+            conditions.append("ts >= ?")
+            params.append(self.start)
+        if self.end is not None:
+            conditions.append("ts < ?")
+            params.append(self.end)
+        if self.server_id is not None:
+            conditions.append("server_id = ?")
+            params.append(self.server_id)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        return where, params
+
+    def _series(self, cursor, where, params, baseline):
+        cursor.execute(
+            "SELECT server_id, username, COUNT(*) FROM traffic_samples"
+            + where
+            + " GROUP BY server_id, username ORDER BY server_id, username",
+            params,
+        )
+        series = cursor.fetchall()
+        ends = np.cumsum(np.array([row[2] for row in series], dtype=np.int64))
+        return _Series(
+            starts=ends - np.array([row[2] for row in series], dtype=np.int64),
+            ends=ends,
+            server=np.array([row[0] for row in series], dtype=np.int64),
+            user=np.array([self._code(row[1]) for row in series], dtype=np.int64),
+            baseline=[baseline.get((row[0], row[1])) for row in series],
+        )
+
+    def __iter__(self):
+        # Exports iterate this from Starlette's threadpool, one chunk per thread hop.
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        try:
+            cursor = conn.cursor()
+            # The series list and the row scan must see the same rows.
+            cursor.execute("BEGIN")
+            where, params = self._where()
+            series = self._series(cursor, where, params, self._baseline(cursor))
+            cursor.execute(
+                "SELECT ts, up, down FROM traffic_samples"
+                + where
+                + " ORDER BY server_id, username, ts",
+                params,
+            )
+
+            position, carry = 0, None
+            while True:
+                rows = cursor.fetchmany(self.chunk_size)
+                if not rows:
+                    break
+                chunk, carry = self._to_chunk(rows, position, carry, series)
+                position += len(rows)
+                yield chunk
+        finally:
+            conn.close()
+
+    def _to_chunk(self, rows, position, carry, series):
+        n = len(rows)
+        columns = np.fromiter(rows, _ROW_DTYPE, n)
+        ts, up, down = columns["ts"], columns["up"], columns["down"]
+
+        # Series overlapping rows [position, position + n).
+        first = np.searchsorted(series.ends, position, side="right")
+        last = np.searchsorted(series.ends, position + n - 1, side="right") + 1
+        starts = series.starts[first:last]
+        lengths = np.minimum(series.ends[first:last], position + n) - np.maximum(
+            starts, position
+        )
+        server = np.repeat(series.server[first:last], lengths)
+        user = np.repeat(series.user[first:last], lengths)
+
+        prev_ts, prev_up, prev_down = (
+            np.empty_like(ts),
+            np.empty_like(up),
+            np.empty_like(down),
+        )
+        for prev, current in ((prev_ts, ts), (prev_up, up), (prev_down, down)):
+            prev[1:] = current[:-1]
+        if carry is not None:
+            prev_ts[0], prev_up[0], prev_down[0] = carry
+
+        has_prev = np.ones(n, dtype=bool)
+        # Only the first row of each series needs a baseline, so this loop
+        # runs once per user and server, not once per sample.
+        for k in np.flatnonzero(starts >= position):
+            i = starts[k] - position
+            base = series.baseline[first + k]
+            if base is None:
+                has_prev[i] = False
+            else:
+                prev_ts[i], prev_up[i], prev_down[i] = base
+
+        # A counter that went backwards was reset, so its value is the delta.
+        up_delta = np.where(up >= prev_up, up - prev_up, up)
+        down_delta = np.where(down >= prev_down, down - prev_down, down)
+        up_delta[~has_prev] = 0
+        down_delta[~has_prev] = 0
+        interval = np.where(has_prev, ts - prev_ts, 0.0)
+
+        carry = (ts[-1], up[-1], down[-1])
+        return TrafficChunk(server, user, ts, up_delta, down_delta, interval), carry
+
+
+class RollupChunk:
+    """One batch of rollups as parallel arrays.
+
+    `ts` is the start of each rollup's hour or day and `up`/`down` the bytes
+    transferred in it. The rate histograms are flattened: entry i counts
+    `rate_count[i]` intervals of user `rate_user[i]` in bin `rate_bin[i]`.
+    """
+
+    __slots__ = (
+        "server",
+        "user",
+        "ts",
+        "up",
+        "down",
+        "rate_user",
+        "rate_bin",
+        "rate_count",
+    )
+
+    def __init__(self, server, user, ts, up, down, rate_user, rate_bin, rate_count):
+        self.server = server
+        self.user = user
+        self.ts = ts
+        self.up = up
+        self.down = down
+        self.rate_user = rate_user
+        self.rate_bin = rate_bin
+        self.rate_count = rate_count
+
+    def __len__(self):
+        return len(self.ts)
+
+
+class RollupReader:
+    """Stream traffic_rollups as RollupChunks; what the reports read.
+
+    Daily rollups are read unless `hourly` is set (hour buckets) or `start`
+    or `end` falls inside a day, in which case hourly ones are. The range is
+    widened to whole rollups, and covers the rollups' retention rather than
+    the raw samples'. Usernames are mapped to integer codes as in
+    SampleReader. A chunk holds whole rollup rows, `chunk_size` series or
+    a few more.
+    """
+
+    def __init__(
+        self,
+        start=None,
+        end=None,
+        server_id=None,
+        hourly=False,
+        chunk_size=CHUNK_SIZE,
+        db_path=DB_PATH,
+    ):
+        unaligned = any(t is not None and t % DAY for t in (start, end))
+        self.resolution = HOUR if hourly or unaligned else DAY
+        self.start = start
+        self.end = end
+        self.server_id = server_id
+        self.chunk_size = chunk_size
+        self.db_path = db_path
+        self.usernames = []
+        self._user_codes = {}
+
+    def _code(self, username):
+        code = self._user_codes.get(username)
+        if code is None:
+            code = self._user_codes[username] = len(self.usernames)
+            self.usernames.append(username)
+        return code
+
+    def _where(self):
+        conditions, params = ["resolution = ?"], [self.resolution]
+        if self.start is not None:
+            conditions.append("start >= ?")
+            params.append(self.start // self.resolution * self.resolution)
+        if self.end is not None:
+            conditions.append("start < ?")
+            params.append(self.end)
+        if self.server_id is not None:
+            conditions.append("server_id = ?")
+            params.append(self.server_id)
+        return " WHERE " + " AND ".join(conditions), params
+
+    def __iter__(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        try:
+            cursor = conn.cursor()
+            # Series names and rollups must come from the same snapshot.
+            cursor.execute("BEGIN")
+            cursor.execute("SELECT id, username FROM traffic_series")
+            names = dict(cursor.fetchall())
+            # Series id -> user code, assigned as series turn up in rollups.
+            codes = np.full(max(names, default=0) + 1, -1, dtype=np.int64)
+
+            where, params = self._where()
+            cursor.execute(
+                "SELECT start, server_id, series, up, down, rates FROM traffic_rollups"
+                + where,
+                params,
+            )
+            rows, size = [], 0
+            for row in cursor:
+                rows.append(row)
+                size += len(row[2]) // 8
+                if size >= self.chunk_size:
+                    yield self._to_chunk(rows, names, codes)
+                    rows, size = [], 0
+            if rows:
+                yield self._to_chunk(rows, names, codes)
+        finally:
+            conn.close()
+
+    def _to_chunk(self, rows, names, codes):
+        series = [np.frombuffer(row[2], np.int64) for row in rows]
+        lengths = [len(s) for s in series]
+        series = np.concatenate(series)
+        for series_id in np.unique(series[codes[series] < 0]).tolist():
+            codes[series_id] = self._code(names[series_id])
+        rates = np.concatenate([np.frombuffer(row[5], RATES_DTYPE) for row in rows])
+        return RollupChunk(
+            np.repeat(np.array([row[1] for row in rows], dtype=np.int64), lengths),
+            codes[series],
+            np.repeat(np.array([row[0] for row in rows], dtype=np.float64), lengths),
+            np.concatenate([np.frombuffer(row[3], np.int64) for row in rows]),
+            np.concatenate([np.frombuffer(row[4], np.int64) for row in rows]),
+            codes[rates["series"]],
+            rates["bin"].astype(np.int64),
+            rates["count"].astype(np.int64),
+        )
+
+
+class _Series:
+    """Row ranges of each (server, user) series in a SampleReader scan."""
+
+    __slots__ = ("starts", "ends", "server", "user", "baseline")
+
+    def __init__(self, starts, ends, server, user, baseline):
+        self.starts = starts
+        self.ends = ends
+        self.server = server
+        self.user = user
+        self.baseline = baseline
+
+
+def _bucket_codes(ts, bucket):
+    seconds = ts.astype(np.int64).astype("datetime64[s]")
+    return seconds.astype(f"datetime64[{BUCKETS[bucket]}]").astype(np.int64)
+
+
+def _bucket_label(code, bucket):
+    return str(np.datetime64(int(code), BUCKETS[bucket]))
+
+
+def _group_sums(keys, values):
+    """Sum each column of `values` per unique row of `keys`."""
+    if len(keys) == 0:
+        return keys, [column[:0] for column in values]
+    # Sorting the rows packed into one int64 is much faster than np.unique
+    # with axis=0, which sorts them as opaque records.
+    low = keys.min(axis=0)
+    spans = keys.max(axis=0) - low + 1
+    if np.prod(spans.astype(np.float64)) < 2**62:
+        packed = np.ravel_multi_index(tuple((keys - low).T), spans)
+        packed, inverse = np.unique(packed, return_inverse=True)
+        unique = np.column_stack(np.unravel_index(packed, spans)) + low
+    else:
+        unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    sums = [
+        np.bincount(inverse, weights=column, minlength=len(unique)) for column in values
+    ]
+    return unique, sums
+
+
+def _validate(group_by, bucket):
+    unknown = [g for g in group_by if g not in GROUP_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown group_by columns: {', '.join(unknown)}")
+    if bucket is not None and bucket not in BUCKETS:
+        raise ValueError(f"Unknown bucket: {bucket}")
+
+
+def usage_report(reader, group_by=("username",), bucket=None):
+    """Total up/down bytes per group, optionally per time bucket.
+
+    `group_by` is any of "server_id" and "username"; `bucket` one of BUCKETS.
+    Returns a list of dicts sorted by the group columns.
+    """
+    _validate(group_by, bucket)
+    partial_keys, partial_up, partial_down = [], [], []
+    for chunk in reader:
+        # Reduce each chunk by the requested columns, so only one row per
+        # group and chunk is kept until the final merge.
+        columns = [(chunk.server, chunk.user)[GROUP_COLUMNS[g]] for g in group_by]
+        if bucket is not None:
+            columns.append(_bucket_codes(chunk.ts, bucket))
+        if not columns:
+            columns.append(np.zeros(len(chunk), dtype=np.int64))
+        keys, (up, down) = _group_sums(np.column_stack(columns), [chunk.up, chunk.down])
+        partial_keys.append(keys)
+        partial_up.append(up)
+        partial_down.append(down)
+
+    if not partial_keys:
+        return []
+    keys, (up, down) = _group_sums(
+        np.concatenate(partial_keys),
+        [np.concatenate(partial_up), np.concatenate(partial_down)],
+    )
+
+    names = list(group_by) + (["bucket"] if bucket is not None else [])
+    rows = []
+    for key, row_up, row_down in zip(keys.tolist(), up.tolist(), down.tolist()):
+        row = {}
+        for name, value in zip(names, key):
+            if name == "username":
+                value = reader.usernames[value]
+            elif name == "bucket":
+                value = _bucket_label(value, bucket)
+            row[name] = value
+        row["up"] = int(row_up)
+        row["down"] = int(row_down)
+        row["total"] = int(row_up) + int(row_down)
+        rows.append(row)
+    return rows
+
+
+def top_users(reader, n=10):
+    """The `n` users with the most total traffic, heaviest first."""
+    totals = None
+    for chunk in reader:
+        chunk_totals = np.bincount(
+            chunk.user, weights=chunk.up + chunk.down, minlength=len(reader.usernames)
+        )
+        if totals is None:
+            totals = chunk_totals
+        else:
+            totals = np.pad(totals, (0, len(chunk_totals) - len(totals)))
+            totals += chunk_totals
+    if totals is None:
+        return []
+    n = min(n, len(totals))
+    top = np.argpartition(-totals, n - 1)[:n]
+    top = top[np.argsort(-totals[top], kind="stable")]
+    return [
+        {"username": reader.usernames[code], "total": int(totals[code])}
+        for code in top.tolist()
+    ]
+
+
+def _histogram_percentiles(histograms, percentiles):
+    """Nearest-rank percentiles of each row of rate bin counts, as rates."""
+    cumulative = np.cumsum(histograms, axis=1)
+    totals = cumulative[:, -1:]
+    result = []
+    for q in percentiles:
+        rank = np.maximum(np.ceil(totals * (q / 100.0)), 1)
+        result.append(RATE_BIN_VALUES[(cumulative < rank).sum(axis=1)])
+    return result
+
+
+def rate_percentiles(reader, percentiles=DEFAULT_PERCENTILES):
+    """Per-user and fleet-wide percentiles of per-interval rates in bytes/s.
+
+    Computed from the rollups' rate histograms, so memory is bounded by
+    users x RATE_BINS and each value is within RATE_ERROR of the exact one.
+    Returns {"fleet": {"p50": ...}, "users": [{"username", "samples", "p50", ...}]}.
+    """
+    if any(not 0 <= q <= 100 for q in percentiles):
+        raise ValueError("Percentiles must be between 0 and 100")
+    counts = None
+    for chunk in reader:
+        chunk_counts = np.bincount(
+            chunk.rate_user * RATE_BINS + chunk.rate_bin,
+            weights=chunk.rate_count,
+            minlength=len(reader.usernames) * RATE_BINS,
+        )
+        if counts is None:
+            counts = chunk_counts
+        else:
+            counts = np.pad(counts, (0, len(chunk_counts) - len(counts)))
+            counts += chunk_counts
+    labels = [f"p{q:g}" for q in percentiles]
+    if counts is None or not counts.any():
+        return {"fleet": {}, "users": []}
+
+    histograms = counts.reshape(-1, RATE_BINS)
+    samples = histograms.sum(axis=1)
+    codes = np.flatnonzero(samples)
+    histograms = histograms[codes]
+    per_user = [
+        values.tolist() for values in _histogram_percentiles(histograms, percentiles)
+    ]
+    fleet = _histogram_percentiles(histograms.sum(axis=0, keepdims=True), percentiles)
+
+    return {
+        "fleet": {label: float(v[0]) for label, v in zip(labels, fleet)},
+        "users": [
+            {
+                "username": reader.usernames[code],
+                "samples": int(samples[code]),
+                **{label: values[i] for label, values in zip(labels, per_user)},
+            }
+            for i, code in enumerate(codes.tolist())
+        ],
+    }
+
+
+def _chunk_columns(reader, chunk):
+    usernames = reader.usernames
+    return {
+        "server_id": chunk.server,
+        "username": [usernames[code] for code in chunk.user.tolist()],
+        "ts": chunk.ts,
+        "up": chunk.up,
+        "down": chunk.down,
+        "interval": chunk.interval,
+    }
+
+
+def stream_csv(reader):
+    """Yield the per-interval usage as CSV, one encoded block per chunk."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for chunk in reader:
+        columns = _chunk_columns(reader, chunk)
+        writer.writerows(
+            zip(
+                *(
+                    columns[name] if name == "username" else columns[name].tolist()
+                    for name in EXPORT_COLUMNS
+                )
+            )
+        )
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+class _DrainingSink:
+    """Write-only file object whose contents are handed out after each batch."""
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def _arrow_schema():
+    return pa.schema(
+        [
+            ("server_id", pa.int64()),
+            ("username", pa.string()),
+            ("ts", pa.float64()),
+            ("up", pa.int64()),
+            ("down", pa.int64()),
+            ("interval", pa.float64()),
+        ]
+    )
+
+
+def _stream_pyarrow(reader, open_writer):
+    if pa is None:
+        raise RuntimeError("pyarrow is not installed")
+    schema = _arrow_schema()
+    sink = _DrainingSink()
+    writer = open_writer(sink, schema)
+    try:
+        for chunk in reader:
+            writer.write_batch(
+                pa.record_batch(_chunk_columns(reader, chunk), schema=schema)
+            )
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def stream_arrow(reader):
+    """Yield the per-interval usage as an Arrow IPC stream, one batch per chunk."""
+    return _stream_pyarrow(reader, lambda sink, schema: pa.ipc.new_stream(sink, schema))
+
+
+def stream_parquet(reader):
+    """Yield the per-interval usage as Parquet, one row group per chunk."""
+    return _stream_pyarrow(reader, lambda sink, schema: pq.ParquetWriter(sink, schema))
+
+
+# format -> (media type, streamer, needs pyarrow)
+EXPORT_FORMATS = {
+    "csv": ("text/csv", stream_csv, False),
+    "arrow": ("application/vnd.apache.arrow.stream", stream_arrow, True),
+    "parquet": ("application/vnd.apache.parquet", stream_parquet, True),
+}
+
+
+def _load_rollups(path, n_users, days, n_servers, seed):
+    """Write daily rollups as a fleet sampled every minute would produce them."""
+    rng = np.random.default_rng(seed)
+    init_db(path)
+    conn = sqlite3.connect(path)
+    day0 = 1_700_006_400
+    last_ts = day0 + days * DAY - 60.0
+    # User u is series u + 1, on server u % n_servers.
+    conn.executemany(
+        "INSERT INTO traffic_series (id, server_id, username, ts, up, down)"
+        " VALUES (?, ?, ?, ?, 0, 0)",
+        ((u + 1, u % n_servers, f"user{u}", last_ts) for u in range(n_users)),
+    )
+    rows = []
+    for day in range(days):
+        for server_id in range(n_servers):
+            series = np.arange(server_id, n_users, n_servers, dtype=np.int64) + 1
+            # 1440 interval rates per day, spread over a dozen neighbouring bins.
+            rates = np.empty((len(series), 12), RATES_DTYPE)
+            rates["series"] = series[:, None]
+            rates["bin"] = rng.integers(100, 200, len(series))[:, None] + np.arange(12)
+            rates["count"] = 120
+            rows.append(
+                (
+                    DAY,
+                    day0 + day * DAY,
+                    server_id,
+                    series.tobytes(),
+                    rng.integers(0, 1 << 30, len(series)).tobytes(),
+                    rng.integers(0, 1 << 32, len(series)).tobytes(),
+                    rates.tobytes(),
+                )
+            )
+    conn.executemany("INSERT INTO traffic_rollups VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+    return last_ts
+
+
+def benchmark(n_users=10_000, days=365, n_servers=50, chunk_size=CHUNK_SIZE, seed=0):
+    """Time the reports on a year of rollups, and recording one more minute.
+
+    The rollups a fleet of `n_users` sampled every minute for `days` days
+    would have built are written to a temporary database (not timed), then
+    the API's report functions read them through RollupReader.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "vless_daddy.db")
+        last_ts = _load_rollups(db_path, n_users, days, n_servers, seed)
+
+        def reader():
+            return RollupReader(chunk_size=chunk_size, db_path=db_path)
+
+        def record_minute():
+            conn = sqlite3.connect(db_path)
+            usage = {"up": 1 << 20, "down": 1 << 22}
+            for server_id in range(n_servers):
+                traffic_data = {
+                    f"user{u}": usage for u in range(server_id, n_users, n_servers)
+                }
+                record_rollups(conn, server_id, traffic_data, last_ts + 60)
+            conn.commit()
+            conn.close()
+
+        timings = {}
+        for name, run in (
+            (
+                "usage by user/month",
+                lambda: usage_report(reader(), ("username",), "month"),
+            ),
+            (
+                "usage by server/day",
+                lambda: usage_report(reader(), ("server_id",), "day"),
+            ),
+            ("top 10 users", lambda: top_users(reader(), 10)),
+            ("rate percentiles", lambda: rate_percentiles(reader())),
+            ("record 1 minute of samples", record_minute),
+        ):
+            started = time.perf_counter()
+            run()
+            timings[name] = time.perf_counter() - started
+    return timings
+
+
+if __name__ == "__main__":
+    n_users = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 365
+    timings = benchmark(n_users, days)
+    print(f"{n_users} users x {days} days of minute-level samples, as daily rollups")
+    for name, seconds in timings.items():
+        print(f"{name:>28}: {seconds:6.2f}s")
@@ -0,0 +1,169 @@
+import itertools
+import math
+import sqlite3
+import time
+
+import numpy as np
+
+DB_PATH = "vless_daddy.db"
+HOUR = 3600
+DAY = 24 * HOUR
+# Rollup resolution -> seconds it is kept. Hourly rollups live as long as the
+# raw samples; daily ones are what long-range reports read.
+ROLLUP_RETENTION = {HOUR: 90 * DAY, DAY: 2 * 365 * DAY}
+
+# Per-interval rates are counted in log-spaced bins instead of being kept:
+# bin 0 holds rates below 1 B/s, bin b >= 1 holds [GROWTH**(b-1), GROWTH**b)
+# and the last bin starts at 10 GB/s. A bin is reported as its geometric
+# midpoint, which is within RATE_ERROR of every rate in it.
+RATE_BINS = 256
+RATE_BIN_GROWTH = 10 ** (10 / (RATE_BINS - 2))
+RATE_ERROR = math.sqrt(RATE_BIN_GROWTH) - 1
+RATE_BIN_VALUES = np.concatenate(
+    ([0.0], RATE_BIN_GROWTH ** (np.arange(1, RATE_BINS) - 0.5))
+)
+# One rollup row holds a server's usage for one hour or day, column-wise:
+# `series`, `up` and `down` are parallel int64 arrays, and `rates` is a
+# sparse histogram of (series, bin, count) entries.
+RATES_DTYPE = np.dtype([("series", "<i8"), ("bin", "u1"), ("count", "<u4")])
+
+
+def rate_bins(rates):
+    """Histogram bin of each rate in bytes/s."""
+    rates = np.asarray(rates, dtype=np.float64)
+    logs = np.log(np.maximum(rates, 1.0)) / math.log(RATE_BIN_GROWTH)
+    bins = np.minimum(np.floor(logs).astype(np.int64) + 1, RATE_BINS - 1)
+    return np.where(rates < 1.0, 0, bins)
+
+
+def _sum_by(keys, *columns):
+    unique, inverse = np.unique(keys, return_inverse=True)
+    sums = []
+    for column in columns:
+        total = np.zeros(len(unique), dtype=np.int64)
+        np.add.at(total, inverse.reshape(-1), column)
+        sums.append(total)
+    return unique, sums
+
+
+def merge_rollup(conn, resolution, server_id, start, series, up, down, rates):
+    """Add per-series usage and rate histogram entries to one rollup row."""
+    row = conn.execute(
+        "SELECT series, up, down, rates FROM traffic_rollups"
+        " WHERE resolution = ? AND start = ? AND server_id = ?",
+        (resolution, start, server_id),
+    ).fetchone()
+    if row is not None:
+        series = np.concatenate([np.frombuffer(row[0], np.int64), series])
+        up = np.concatenate([np.frombuffer(row[1], np.int64), up])
+        down = np.concatenate([np.frombuffer(row[2], np.int64), down])
+        rates = np.concatenate([np.frombuffer(row[3], RATES_DTYPE), rates])
+    series, (up, down) = _sum_by(series, up, down)
+    keys, (counts,) = _sum_by(
+        rates["series"] * RATE_BINS + rates["bin"], rates["count"]
+    )
+    merged = np.empty(len(keys), RATES_DTYPE)
+    merged["series"] = keys // RATE_BINS
+    merged["bin"] = keys % RATE_BINS
+    merged["count"] = counts
+    conn.execute(
+        "INSERT OR REPLACE INTO traffic_rollups VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (
+            resolution,
+            start,
+            server_id,
+            series.tobytes(),
+            up.tobytes(),
+            down.tobytes(),
+            merged.tobytes(),
+        ),
+    )
+
+
+def record_rollups(conn, server_id: int, traffic_data: dict, ts: float) -> None:
+    """Add the usage since each user's previous sample to the rollups.
+
+    The last counters of every series (server and user) are kept in
+    traffic_series, so this never reads traffic_samples. A user's first
+    sample only sets the baseline, and a sample no newer than the previous
+    one is ignored.
+    """
+    known = {
+        row[0]: row[1:]
+        for row in conn.execute(
+            "SELECT username, id, ts, up, down FROM traffic_series WHERE server_id = ?",
+            (server_id,),
+        )
+    }
+    new, updates, deltas = [], [], []
+    for username, usage in traffic_data.items():
+        up, down = usage["up"], usage["down"]
+        last = known.get(username)
+        if last is None:
+            new.append((server_id, username, ts, up, down))
+            continue
+        series_id, last_ts, last_up, last_down = last
+        if ts <= last_ts:
+            continue
+        # A counter that went backwards was reset, so its value is the delta.
+        up_delta = up - last_up if up >= last_up else up
+        down_delta = down - last_down if down >= last_down else down
+        deltas.append((series_id, up_delta, down_delta, ts - last_ts))
+        updates.append((ts, up, down, series_id))
+    conn.executemany(
+        "INSERT INTO traffic_series (server_id, username, ts, up, down) VALUES (?, ?, ?, ?, ?)",
+        new,
+    )
+    conn.executemany(
+        "UPDATE traffic_series SET ts = ?, up = ?, down = ? WHERE id = ?", updates
+    )
+    if not deltas:
+        return
+
+    series, up, down, interval = (np.array(column) for column in zip(*deltas))
+    rates = np.empty(len(series), RATES_DTYPE)
+    rates["series"] = series
+    rates["bin"] = rate_bins((up + down) / interval)
+    rates["count"] = 1
+    for resolution in ROLLUP_RETENTION:
+        start = int(ts // resolution) * resolution
+        merge_rollup(conn, resolution, server_id, start, series, up, down, rates)
+
+
+def prune_rollups(conn, retention=ROLLUP_RETENTION) -> int:
+    """Delete rollups past their resolution's retention; returns the rows removed."""
+    now = time.time()
+    pruned = 0
+    for resolution, seconds in retention.items():
+        pruned += conn.execute(
+            "DELETE FROM traffic_rollups WHERE resolution = ? AND start < ?",
+            (resolution, now - seconds),
+        ).rowcount
+    return pruned
+
+
+def backfill_rollups(db_path=DB_PATH) -> int:
+    """Build the rollups by replaying the stored samples, once.
+
+    Databases from before rollups existed have samples but no series; one
+    that has series already is left alone. Returns the snapshots replayed.
+    """
+    conn = sqlite3.connect(db_path)
+    samples = sqlite3.connect(db_path)
+    try:
+        if conn.execute("SELECT 1 FROM traffic_series LIMIT 1").fetchone():
+            return 0
+        rows = samples.execute(
+            "SELECT server_id, ts, username, up, down FROM traffic_samples"
+            " ORDER BY server_id, ts"
+        )
+        replayed = 0
+        for (server_id, ts), snapshot in itertools.groupby(rows, lambda r: r[:2]):
+            traffic_data = {r[2]: {"up": r[3], "down": r[4]} for r in snapshot}
+            record_rollups(conn, server_id, traffic_data, ts)
+            replayed += 1
+        conn.commit()
+        return replayed
+    finally:
+        samples.close()
+        conn.close()
@@ -1,4 +1,4 @@
-import React, { useCallback, useEffect, useState } from 'react';
+import React, { useCallback, useEffect, useRef, useState } from 'react';
 import { Link, useParams } from 'react-router-dom';
 
 function formatBytes(bytes, decimals = 2) {
@@ -17,6 +17,7 @@ function Clients() {
     const [traffic, setTraffic] = useState({});
     const [error, setError] = useState(null);
     const [selectedClient, setSelectedClient] = useState(null);
+    const clientsVersion = useRef(null);
 
     const fetchServerDetails = useCallback(() => {
         fetch(`/api/servers/${serverId}`)
@@ -27,11 +28,36 @@ function Clients() {
 
     const fetchClients = useCallback(() => {
         fetch(`/api/servers/${serverId}/clients`)
-            .then(res => res.json())
+            .then(res => {
+                clientsVersion.current = res.headers.get('X-Collection-Version');
+                return res.json();
+            })
             .then(data => setClients(data))
             .catch(() => setError('Could not fetch clients.'));
     }, [serverId]);
 
+    // Apply only the changes made since the list was loaded.
+    const fetchClientChanges = useCallback(() => {
+        if (clientsVersion.current === null) return fetchClients();
+        fetch(`/api/servers/${serverId}/clients?since=${clientsVersion.current}`)
+            .then(res => {
+                if (!res.ok) throw new Error('stale version');
+                return res.json();
+            })
+            .then(({ version, changes }) => {
+                clientsVersion.current = version;
+                setClients(prev => {
+                    const byId = new Map(prev.map(client => [client.id, client]));
+                    for (const { op, record } of changes) {
+                        if (op === 'delete') byId.delete(record.id);
+                        else byId.set(record.id, record);
+                    }
+                    return [...byId.values()].sort((a, b) => a.id - b.id);
+                });
+            })
+            .catch(() => fetchClients());
+    }, [serverId, fetchClients]);
+
     const fetchTraffic = useCallback(() => {
         setTraffic({}); // Clear old data while fetching
         fetch(`/api/servers/${serverId}/traffic`)
@@ -56,14 +82,14 @@ function Clients() {
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify(data),
         });
-        fetchClients();
+        fetchClientChanges();
         event.target.reset();
     };
 
     const handleDeleteClient = async (clientId) => {
         if (window.confirm("Are you sure you want to delete this client?")) {
             await fetch(`/api/servers/${serverId}/clients/${clientId}`, { method: 'DELETE' });
-            fetchClients();
+            fetchClientChanges();
         }
     };
 
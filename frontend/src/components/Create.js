@@ -1,6 +1,8 @@
-import React, { useState } from 'react';
+import React, { useEffect, useState } from 'react';
 import { Link } from 'react-router-dom';
 
+const JOB_STORAGE_KEY = 'provisionJobId';
+
 const stepsConfig = [
     { key: 'cleanup', title: 'Cleaning Server', subtitle: 'Removing old configuration and logs.' },
     { key: 'connect', title: 'Connecting to Server', subtitle: 'Establishing SSH connection...' },
@@ -30,20 +32,7 @@ function Create() {
         setFormData(prev => ({ ...prev, [name]: value }));
     };
 
-    const startProxyCreation = async (overwrite = false) => {
-        setInProgress(true);
-        setStatuses({});
-        setResult(null);
-        setError(null);
-
-        const payload = { ...formData, overwrite };
-
-        const response = await fetch('/api/proxy', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify(payload),
-        });
-
+    const followProgress = async (response) => {
         const reader = response.body.getReader();
         const decoder = new TextDecoder();
 
@@ -62,7 +51,9 @@ function Create() {
                     } else if (line.startsWith("result:")) {
                         setResult(JSON.parse(line.substring(7)));
                         setInProgress(false);
+                        localStorage.removeItem(JOB_STORAGE_KEY);
                     } else if (line.startsWith("error:")) {
+                        localStorage.removeItem(JOB_STORAGE_KEY);
                         const errorMsg = line.substring(6);
                         if (errorMsg === 'exists') {
                             if (window.confirm("A proxy configuration already exists on this server. Do you want to overwrite it?")) {
@@ -87,6 +78,43 @@ function Create() {
         }
     };
 
+    const startProxyCreation = async (overwrite = false) => {
+        setInProgress(true);
+        setStatuses({});
+        setResult(null);
+        setError(null);
+
+        const payload = { ...formData, overwrite };
+
+        const response = await fetch('/api/proxy', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(payload),
+        });
+
+        // Remember the job so a reload can reattach to its progress.
+        localStorage.setItem(JOB_STORAGE_KEY, response.headers.get('X-Job-Id'));
+        await followProgress(response);
+    };
+
+    useEffect(() => {
+        const jobId = localStorage.getItem(JOB_STORAGE_KEY);
+        if (!jobId) return;
+
+        fetch(`/api/jobs/${jobId}`)
+            .then(res => (res.ok ? res.json() : null))
+            .then(job => {
+                if (!job || job.status === 'completed' || job.status === 'failed') {
+                    localStorage.removeItem(JOB_STORAGE_KEY);
+                    return;
+                }
+                setInProgress(true);
+                return fetch(`/api/jobs/${jobId}/events`).then(followProgress);
+            })
+            .catch(() => setError('Could not reattach to the running provisioning job.'));
+        // eslint-disable-next-line react-hooks/exhaustive-deps
+    }, []);
+
     const handleSubmit = (event) => {
         event.preventDefault();
         startProxyCreation(false);